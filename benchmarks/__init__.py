@@ -0,0 +1,6 @@
+"""
+Benchmarks for the encode, decode and projection hot paths.
+
+Run them with `python -m benchmarks run -o result.json` and compare two
+runs with `python -m benchmarks compare base.json result.json`.
+"""
@@ -0,0 +1,210 @@
+"""
+Benchmark cases.
+
+A case is a function taking a scale factor and returning (ops, run):
+run() does ops units of work, such as points added or features decoded,
+on data prepared up front so only the code under test is timed. Cases
+register themselves in CASES under a dotted name.
+"""
+
+from collections import OrderedDict
+
+import vector_tile
+from vector_tile import renderer, vector_tile_pb2
+from vector_tile.reader import TileReader
+
+from . import data
+
+CASES = OrderedDict()
+
+
+def case(name):
+    def register(func):
+        CASES[name] = func
+        return func
+    return register
+
+
+def _points_tile(req, n):
+    xs, ys = data.dense_points(req, n)
+    vtile = renderer.VectorTile(req)
+    vtile.add_points(vtile.add_layer('points'), xs, ys,
+                     data.attributes(n, n // 10 or 1), skip_coincident=False)
+    return vtile
+
+
+@case('mercator.ll_to_px')
+def mercator_ll_to_px(scale):
+    n = int(20000 * scale)
+    merc = renderer.get_mercator()
+    xs, ys = data.dense_points(data.request('z0'), n)
+    lonlats = [renderer.merc2lonlat(x, y) for x, y in zip(xs, ys)]
+    def run():
+        for ll in lonlats:
+            merc.ll_to_px(ll, 14)
+    return n, run
+
+
+@case('mercator.px_to_ll')
+def mercator_px_to_ll(scale):
+    n = int(20000 * scale)
+    merc = renderer.get_mercator()
+    xs, ys = data.dense_points(data.request('z0'), n)
+    pxs = [(x / 10.0, y / 10.0) for x, y in zip(xs, ys)]
+    def run():
+        for px in pxs:
+            merc.px_to_ll(px, 14)
+    return n, run
+
+
+@case('mercator.ll_to_px_array')
+def mercator_ll_to_px_array(scale):
+    n = int(200000 * scale)
+    merc = renderer.get_mercator()
+    lon, lat = renderer.merc2lonlat_array(*data.dense_points(data.request('z0'), n))
+    def run():
+        merc.ll_to_px_array(lon, lat, 14)
+    return n, run
+
+
+@case('request.create')
+def request_create(scale):
+    n = int(20000 * scale)
+    coords = [(x, y) for x in range(128) for y in range(128)][:n]
+    def run():
+        renderer._extents.clear()
+        for x, y in coords:
+            renderer.Request(x, y, 7)
+    return len(coords), run
+
+
+@case('vtile.handle_attr')
+def vtile_handle_attr(scale):
+    n = int(5000 * scale)
+    props = data.attributes(n, n // 4 or 1)
+    def run():
+        vtile = renderer.VectorTile(data.request('z14'))
+        layer = vtile.add_layer('attrs')
+        for p in props:
+            vtile._handle_attr(layer, layer.features.add(), p)
+    return n, run
+
+
+def _add_point_case(tile):
+    def make(scale):
+        n = int(5000 * scale)
+        req = data.request(tile)
+        xs, ys = data.dense_points(req, n)
+        props = data.attributes(n, n // 10 or 1)
+        def run():
+            vtile = renderer.VectorTile(req)
+            layer = vtile.add_layer('points')
+            for x, y, p in zip(xs, ys, props):
+                vtile.add_point(layer, x, y, p)
+        return n, run
+    return make
+
+
+def _add_points_case(tile):
+    def make(scale):
+        n = int(20000 * scale)
+        req = data.request(tile)
+        xs, ys = data.dense_points(req, n)
+        props = data.attributes(n, n // 10 or 1)
+        def run():
+            vtile = renderer.VectorTile(req)
+            vtile.add_points(vtile.add_layer('points'), xs, ys, props)
+        return n, run
+    return make
+
+
+for _tile in sorted(data.TILES, key=lambda t: data.TILES[t][2]):
+    case('vtile.add_point.' + _tile)(_add_point_case(_tile))
+    case('vtile.add_points.' + _tile)(_add_points_case(_tile))
+
+
+@case('vtile.add_line')
+def vtile_add_line(scale):
+    n = int(200 * scale)
+    req = data.request('z14')
+    lines = data.long_lines(req, n, 500)
+    props = data.attributes(n, n)
+    def run():
+        vtile = renderer.VectorTile(req)
+        layer = vtile.add_layer('lines')
+        for line, p in zip(lines, props):
+            vtile.add_line(layer, line, p)
+    return n * 500, run
+
+
+@case('vtile.add_polygon')
+def vtile_add_polygon(scale):
+    n = int(100 * scale)
+    req = data.request('z14')
+    polygons = data.many_ring_polygons(req, n, 20, 64)
+    props = data.attributes(n, n)
+    def run():
+        vtile = renderer.VectorTile(req)
+        layer = vtile.add_layer('polygons')
+        for rings, p in zip(polygons, props):
+            vtile.add_polygon(layer, rings, p)
+    return n * 20 * 65, run
+
+
+@case('vtile.to_geojson')
+def vtile_to_geojson(scale):
+    n = int(5000 * scale)
+    vtile = _points_tile(data.request('z14'), n)
+    def run():
+        vtile.to_geojson(lonlat=True)
+    return n, run
+
+
+@case('vtile.from_message')
+def vtile_from_message(scale):
+    n = int(5000 * scale)
+    req = data.request('z14')
+    message = _points_tile(req, n).to_message()
+    def run():
+        renderer.VectorTile.from_message(req, message)
+    return n, run
+
+
+# counting the features of every layer, lazily and through the protobuf
+# backend, which is compiled unless it was installed pure python
+@case('reader.count_features')
+def reader_count_features(scale):
+    n = int(20000 * scale)
+    message = _points_tile(data.request('z14'), n).to_message()
+    def run():
+        sum(len(layer) for layer in TileReader(message).layers)
+    return n, run
+
+
+@case('protobuf.count_features')
+def protobuf_count_features(scale):
+    n = int(20000 * scale)
+    message = _points_tile(data.request('z14'), n).to_message()
+    def run():
+        tile = vector_tile_pb2.Tile()
+        tile.ParseFromString(message)
+        sum(len(layer.features) for layer in tile.layers)
+    return n, run
+
+
+@case('vtile.to_message')
+def vtile_to_message(scale):
+    n = int(5000 * scale)
+    vtile = _points_tile(data.request('z14'), n)
+    def run():
+        vtile.to_message()
+    return n, run
+
+
+@case('layer.encode')
+def layer_encode(scale):
+    n = int(3000 * scale)
+    features = data.tile_features(n)
+    def run():
+        vector_tile.layer('features', features)
+    return n, run
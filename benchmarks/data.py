@@ -0,0 +1,129 @@
+"""
+Synthetic datasets for the benchmarks.
+
+Every generator takes a seed and uses its own RandomState, so a given
+seed always yields the same data. Coordinates are mercator meters inside
+a fixture tile unless noted otherwise.
+"""
+
+import numpy as np
+
+from vector_tile import renderer
+
+# fixed (x, y, zoom) tiles spanning the zoom range
+TILES = {
+    'z0': (0, 0, 0),
+    'z7': (37, 48, 7),
+    'z14': (4685, 6265, 14),
+    'z22': (1199268, 1603922, 22),
+}
+
+SEED = 20140101
+
+
+def request(name):
+    "Request of fixture tile name, one of TILES"
+    x, y, zoom = TILES[name]
+    return renderer.Request(x, y, zoom)
+
+
+def _uniform(rs, req, n):
+    e = req.extent
+    return rs.uniform(e.minx, e.maxx, n), rs.uniform(e.miny, e.maxy, n)
+
+
+def dense_points(req, n, seed=SEED):
+    "Arrays xs, ys of n points scattered over the tile"
+    return _uniform(np.random.RandomState(seed), req, n)
+
+
+def long_lines(req, n, length, seed=SEED):
+    "n random walks of length vertices as [[x, y], ...] lists"
+    rs = np.random.RandomState(seed)
+    e = req.extent
+    step = e.width() / 100.0
+    xs, ys = _uniform(rs, req, n)
+    lines = []
+    for i in range(n):
+        walk = rs.normal(0, step, (length, 2)).cumsum(axis=0)
+        walk[:, 0] += xs[i]
+        walk[:, 1] += ys[i]
+        lines.append(walk.tolist())
+    return lines
+
+
+def many_ring_polygons(req, n, rings, vertices, seed=SEED):
+    """
+    n polygons of one outer ring and rings - 1 holes, each ring a closed
+    circle of vertices points
+    """
+    rs = np.random.RandomState(seed)
+    e = req.extent
+    radius = e.width() / 10.0
+    xs, ys = _uniform(rs, req, n)
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    polygons = []
+    for i in range(n):
+        polygon = []
+        for j in range(rings):
+            if j == 0:
+                cx, cy, r = xs[i], ys[i], radius
+                direction = 1
+            else:
+                # holes stay inside the outer ring and wind the other way
+                a = rs.uniform(0, 2 * np.pi)
+                d = rs.uniform(0, 0.6) * radius
+                cx, cy = xs[i] + d * np.cos(a), ys[i] + d * np.sin(a)
+                r = radius * 0.3 / rings
+                direction = -1
+            ring = np.column_stack((cx + r * np.cos(direction * angles),
+                                    cy + r * np.sin(direction * angles)))
+            ring = np.vstack((ring, ring[:1]))
+            polygon.append(ring.tolist())
+        polygons.append(polygon)
+    return polygons
+
+
+def attributes(n, cardinality, seed=SEED):
+    """
+    n property dicts mixing ints, floats, bools and strings; 'name' takes
+    up to cardinality distinct values and 'class' only a handful
+    """
+    rs = np.random.RandomState(seed)
+    classes = ['motorway', 'primary', 'secondary', 'residential', 'path']
+    names = rs.randint(0, cardinality, n)
+    kinds = rs.randint(0, len(classes), n)
+    ranks = rs.uniform(0, 100, n)
+    props = []
+    for i in range(n):
+        props.append({
+            'id': i,
+            'name': 'feature %d' % names[i],
+            'class': classes[kinds[i]],
+            'rank': float(ranks[i]),
+            'oneway': bool(kinds[i] % 2),
+        })
+    return props
+
+
+def tile_features(n, extent=4096, seed=SEED):
+    """
+    GeoJSON features in tile units for vector_tile.layer(): a mix of
+    points, lines and polygons with attributes
+    """
+    rs = np.random.RandomState(seed)
+    props = attributes(n, n // 4 or 1, seed)
+    features = []
+    for i in range(n):
+        kind = i % 3
+        if kind == 0:
+            geom = {'type': 'Point', 'coordinates': rs.randint(0, extent, 2).tolist()}
+        elif kind == 1:
+            walk = rs.randint(-64, 64, (20, 2)).cumsum(axis=0) + extent // 2
+            geom = {'type': 'LineString', 'coordinates': walk.tolist()}
+        else:
+            x, y = rs.randint(0, extent - 256, 2).tolist()
+            ring = [[x, y], [x + 256, y], [x + 256, y + 256], [x, y + 256], [x, y]]
+            geom = {'type': 'Polygon', 'coordinates': [ring]}
+        features.append({'geometry': geom, 'properties': props[i]})
+    return features
@@ -0,0 +1,178 @@
+"""
+Benchmark runner, used through `python -m benchmarks`.
+
+    python -m benchmarks list
+    python -m benchmarks run [-o result.json] [-k pattern] [--scale 0.1] [--inline]
+    python -m benchmarks compare base.json result.json [--threshold 0.1]
+
+run times every case as the best of --repeat runs and records its
+throughput, the peak memory traced by tracemalloc during one more run,
+and the peak RSS of the process. By default each case runs in a fresh
+interpreter so peak RSS belongs to that case alone; --inline runs them
+all in this process, where peak RSS only ever grows.
+
+compare flags a case as a regression when its throughput dropped, or its
+traced peak memory grew, by more than the threshold fraction, and exits
+with status 1 if any did.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import numpy as np
+
+
+def peak_rss():
+    "Peak resident set size of this process in bytes, or None"
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere but macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def environment():
+    from google.protobuf.internal import api_implementation
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'protobuf': api_implementation.Type(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def measure(name, scale=1.0, repeat=5):
+    "Run case name and return its measurements"
+    from .cases import CASES
+    ops, run = CASES[name](scale)
+    run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        run()
+        alloc_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    best = min(times)
+    return {
+        'ops': ops,
+        'seconds': best,
+        'median_seconds': sorted(times)[len(times) // 2],
+        'throughput': ops / best if best else float('inf'),
+        'alloc_peak': alloc_peak,
+        'rss_peak': peak_rss(),
+    }
+
+
+def select(pattern=None):
+    from .cases import CASES
+    return [name for name in CASES if not pattern or pattern in name]
+
+
+def run(args):
+    results = {}
+    for name in select(args.k):
+        if args.inline:
+            result = measure(name, args.scale, args.repeat)
+        else:
+            out = subprocess.check_output(
+                [sys.executable, '-m', 'benchmarks', '_case', name,
+                 '--scale', str(args.scale), '--repeat', str(args.repeat)])
+            result = json.loads(out.decode('utf-8'))
+        results[name] = result
+        sys.stderr.write('%-32s %12.0f ops/s %10.1f KiB peak\n' % (
+            name, result['throughput'], result['alloc_peak'] / 1024.0))
+    report = {'environment': environment(),
+              'scale': args.scale, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    return 0
+
+
+def compare(base, result, threshold=0.1):
+    """
+    Return a list of (name, metric, old, new, change, regressed) for the
+    cases of result also in base
+    """
+    rows = []
+    for name, new in sorted(result['results'].items()):
+        old = base['results'].get(name)
+        if old is None:
+            continue
+        for metric, higher_is_better in (('throughput', True), ('alloc_peak', False)):
+            if not old[metric]:
+                continue
+            change = float(new[metric]) / old[metric] - 1
+            regressed = -change > threshold if higher_is_better else change > threshold
+            rows.append((name, metric, old[metric], new[metric], change, regressed))
+    return rows
+
+
+def run_compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.result) as f:
+        result = json.load(f)
+    if base.get('scale') != result.get('scale'):
+        sys.stderr.write('warning: runs used different scales\n')
+    rows = compare(base, result, args.threshold)
+    for name, metric, old, new, change, regressed in rows:
+        print('%-32s %-10s %14.1f %14.1f %+7.1f%%%s' % (
+            name, metric, old, new, change * 100, '  REGRESSION' if regressed else ''))
+    return 1 if any(row[-1] for row in rows) else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('list', help='list benchmark cases')
+    p = commands.add_parser('run', help='run benchmarks')
+    p.add_argument('-o', '--output', help='write JSON here instead of stdout')
+    p.add_argument('-k', help='only run cases whose name contains this')
+    p.add_argument('--scale', type=float, default=1.0, help='multiply dataset sizes')
+    p.add_argument('--repeat', type=int, default=5)
+    p.add_argument('--inline', action='store_true',
+                   help='run every case in this process')
+    p = commands.add_parser('_case')
+    p.add_argument('name')
+    p.add_argument('--scale', type=float, default=1.0)
+    p.add_argument('--repeat', type=int, default=5)
+    p = commands.add_parser('compare', help='compare two runs')
+    p.add_argument('base')
+    p.add_argument('result')
+    p.add_argument('--threshold', type=float, default=0.1,
+                   help='fractional change counted as a regression')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        print('\n'.join(select()))
+        return 0
+    if args.command == 'run':
+        return run(args)
+    if args.command == '_case':
+        json.dump(measure(args.name, args.scale, args.repeat), sys.stdout)
+        return 0
+    if args.command == 'compare':
+        return run_compare(args)
+    parser.print_help()
+    return 2
@@ -3,7 +3,6 @@
 
 import sys
 import json
-import gzip
 from vector_tile import renderer
 
 if __name__ == "__main__" :
@@ -37,16 +36,9 @@ if __name__ == "__main__" :
     print('-'*60)
     # print the protobuf message
     if sys.version_info.major == 3:
-        print('Serialized, gzip-coded tile message as bytes:')
-        print(vtile.to_message())
-        print('Gzip-coded tile message:')
-        print(gzip.compress(vtile.to_message()))
+        print('Serialized tile message as bytes:')
     else:
-        print('Serialized, gzip-coded tile message as string:')
-        print(vtile.to_message())
-        print('Gzip-coded tile message:')
-        import StringIO
-        out = StringIO.StringIO()
-        with gzip.GzipFile(fileobj=out, mode="w") as f:
-          f.write(vtile.to_message())
-        print(out.getvalue())
+        print('Serialized tile message as string:')
+    print(vtile.to_message())
+    print('Gzip-coded tile message:')
+    print(vtile.to_message(compression='gzip'))
@@ -21,12 +21,16 @@ setup(name='vector_tile',
       author_email='sean@mapbox.com',
       url='https://github.com/mapbox/vector-tile-py',
       license='BSD',
-      packages=find_packages(exclude=['ez_setup', 'examples', 'tests']),
+      packages=find_packages(exclude=['ez_setup', 'examples', 'tests', 'benchmarks']),
       include_package_data=True,
       zip_safe=False,
       install_requires=[
-        'protobuf'
+        'protobuf',
+        'numpy'
       ],
+      extras_require={
+        'zstd': ['zstandard']
+      },
       entry_points="""
       # -*- Entry points: -*-
       """,
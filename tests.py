@@ -2,11 +2,39 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import os
+import shutil
+import tempfile
+import hashlib
 import unittest
 import json
+import sqlite3
+import numpy as np
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
+import vector_tile
+from vector_tile import archive
+from vector_tile import cache
+from vector_tile import compression
+from vector_tile import geometry
+from vector_tile import mbtiles as mbtiles_module
+from vector_tile import pyramid
+from vector_tile import query
 from vector_tile import renderer
+from vector_tile import tilecover
 from vector_tile import vector_tile_pb2
+from vector_tile.mbtiles import MBTiles
+from vector_tile.reader import LayerReader, TileReader
+from vector_tile.stats import Stats, clock
+if sys.version_info >= (3, 5):
+    import asyncio
+    from vector_tile import server
+    from benchmarks import data as bench_data, runner as bench_runner
+else:
+    server = bench_runner = None
 
 class TestRequestCtrans(unittest.TestCase):
     def test_lonlat2merc(self):
@@ -16,6 +44,26 @@ class TestRequestCtrans(unittest.TestCase):
         self.assertAlmostEqual(-20037508.342789244,x)
         self.assertAlmostEqual(-19971868.8804085888,y)
 
+    def test_projection_arrays_match_scalar(self):
+        merc = renderer.SphericalMercator()
+        lons = [-180, -121.5, 0, 12.25, 179.9]
+        lats = [-85, 38.1, 0, -33.3, 89.9]
+        xs, ys = renderer.lonlat2merc_array(lons, lats)
+        lon2, lat2 = renderer.merc2lonlat_array(xs, ys)
+        px, py = merc.ll_to_px_array(lons, lats, 7)
+        lon3, lat3 = merc.px_to_ll_array(px, py, 7)
+        bboxes = [[x - 1000, y - 1000, x + 1000, y + 1000] for x, y in zip(xs, ys)]
+        tiles = merc.xyz_array(bboxes, 9)
+        for i, (lon, lat) in enumerate(zip(lons, lats)):
+            x, y = renderer.lonlat2merc(lon, lat)
+            self.assertAlmostEqual(xs[i], x)
+            self.assertAlmostEqual(ys[i], y)
+            self.assertAlmostEqual(lon2[i], lon)
+            self.assertAlmostEqual(lat2[i], lat)
+            self.assertEqual((px[i], py[i]), merc.ll_to_px((lon, lat), 7))
+            self.assertEqual((lon3[i], lat3[i]), merc.px_to_ll((px[i], py[i]), 7))
+            self.assertEqual(tiles[i].tolist(), merc.xyz(bboxes[i], 9))
+
     def test_box2d(self):
         box = renderer.Box2d(-180,-85,180,85)
         assert box.minx == -180
@@ -47,6 +95,53 @@ class TestRequestCtrans(unittest.TestCase):
         assert req.extent.intersects(-13469658, 4579425)# -121,38
         assert not req.extent.intersects(-14471533.80, 5621521.49)
 
+    def test_request_shares_mercator_and_extent(self):
+        req = renderer.Request(20,49,7)
+        req2 = renderer.Request(20,49,7)
+        assert req.mercator is req2.mercator
+        assert req.extent is req2.extent
+        self.assertEqual(req.bounds(), renderer.Box2d(
+            *renderer.SphericalMercator().bbox(20,49,7)).bounds())
+        self.assertRaises(AttributeError, setattr, req, 'foo', 1)
+
+    def test_value_objects_are_immutable(self):
+        import pickle
+        req = renderer.Request(20,49,7)
+        ctrans = renderer.CoordTransform(req)
+        for ob, attr in ((req, 'x'), (req.extent, 'minx'), (ctrans, 'sx')):
+            self.assertRaises(AttributeError, setattr, ob, attr, 1)
+            self.assertRaises(AttributeError, delattr, ob, attr)
+            assert not hasattr(ob, '__dict__')
+        self.assertEqual(req, renderer.Request(20,49,7))
+        self.assertNotEqual(req, renderer.Request(20,48,7))
+        self.assertEqual(len(set([req, renderer.Request(20,49,7)])), 1)
+        self.assertEqual(pickle.loads(pickle.dumps(req)), req)
+        self.assertEqual(pickle.loads(pickle.dumps(req.extent)), req.extent)
+
+    def test_tile_grid(self):
+        grid = renderer.TileGrid.from_range(7, 19, 48, 21, 50)
+        self.assertEqual(len(grid), 9)
+        self.assertEqual(grid.nbytes, 9 * 9)
+        self.assertEqual(grid[4], renderer.Request(20,49,7))
+        self.assertEqual([r.x for r in grid[grid.y == 50]], [19, 20, 21])
+        extents = grid.extents()
+        for req, bounds in zip(grid, extents):
+            for a, b in zip(req.bounds(), bounds):
+                self.assertAlmostEqual(a, b, places=6)
+        grid = renderer.TileGrid.from_tiles([(0,0,0), (22,5,6)])
+        self.assertEqual(list(grid), [renderer.Request(0,0,0), renderer.Request(5,6,22)])
+        self.assertRaises(ValueError, renderer.TileGrid, [0], [0], 23)
+
+    def test_lru_cache(self):
+        cache = renderer.LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)
+        cache['c'] = 3
+        self.assertEqual(len(cache), 2)
+        assert cache.get('b') is None
+        self.assertEqual(cache.get('a'), 1)
+
     def test_ctrans_z0(self):
         req = renderer.Request(0,0,0)
         x,y = renderer.lonlat2merc(-180,-85)
@@ -173,6 +268,60 @@ class TestTileCreation(unittest.TestCase):
         vtile.add_point(layer, width*.5, height*.5, {"goodbye":"world"})
         assert len(layer.keys) == 2 and len(layer.values) == 2
 
+    def test_compressed_messages(self):
+        """ Test compressing tiles and detecting the compression on load """
+        req = renderer.Request(0,0,0)
+        vtile = renderer.VectorTile(req)
+        layer = vtile.add_layer(name="points")
+        vtile.add_point(layer, 0, 0, {"hello":"world"})
+        raw = vtile.to_message()
+        methods = ['gzip', 'zlib']
+        if compression.zstandard is not None:
+            methods.append('zstd')
+        for method in methods:
+            data = vtile.to_message(compression=method, level=6)
+            self.assertEqual(compression.detect(data), method)
+            self.assertEqual(compression.detect(memoryview(data)), method)
+            self.assertEqual(compression.decompress(memoryview(data)), raw)
+            self.assertEqual(vtile.to_message(compression=method, level=6), data)
+            self.assertEqual(compression.decompress(data), raw)
+            vtile2 = renderer.VectorTile.from_message(req, data)
+            self.assertEqual(vtile2.to_geojson(), vtile.to_geojson())
+        assert compression.detect(raw) is None
+        self.assertEqual(compression.decompress(raw), raw)
+        self.assertRaises(ValueError, vtile.to_message, compression='lzma')
+
+    def test_value_interning_is_typed(self):
+        """ Test that values equal in Python but of different types are kept apart """
+        req = renderer.Request(0,0,0)
+        vtile = renderer.VectorTile(req)
+        layer = vtile.add_layer(name="points")
+        width = req.get_width()
+        vtile.add_point(layer, width*.1, 0, {"v":True})
+        vtile.add_point(layer, width*.2, 0, {"v":1})
+        vtile.add_point(layer, width*.3, 0, {"v":1.0})
+        vtile.add_point(layer, width*.4, 0, {"v":1})
+        assert len(layer.keys) == 1 and len(layer.values) == 3
+        props = [f['properties']['v'] for f in vtile.to_geojson()['features']]
+        self.assertEqual([type(v) for v in props], [bool, int, float, int])
+
+    def test_interning_loaded_tile(self):
+        """ Test that a loaded tile reuses its existing keys and values """
+        req = renderer.Request(0,0,0)
+        vtile = renderer.VectorTile(req)
+        layer = vtile.add_layer(name="points")
+        vtile.add_point(layer, 0, 0, {"hello":"world"})
+        tile = vector_tile_pb2.Tile()
+        tile.ParseFromString(vtile.to_message())
+        # a Value with no field set is accepted and skipped
+        tile.layers[0].values.add()
+        vtile2 = renderer.VectorTile(req, tile)
+        self.assertEqual(vtile2.keys, {})
+        layer2 = tile.layers[0]
+        vtile2.add_point(layer2, req.get_width()*.1, 0, {"hello":"world", "n":2})
+        assert len(layer2.keys) == 2 and len(layer2.values) == 3
+        self.assertEqual(list(layer2.features[1].tags), [0, 0, 1, 2])
+
     def test_adding_duplicate_points(self):
         """ Test that points are deduplicated """
         req = renderer.Request(0,0,0)
@@ -184,6 +333,89 @@ class TestTileCreation(unittest.TestCase):
         j_obj = vtile.to_geojson()
         self.assertEqual(len(j_obj['features']),1)
 
+    def test_adding_duplicate_points_keep_last(self):
+        """ Test that coincident points can keep the last properties """
+        req = renderer.Request(0,0,0)
+        vtile = renderer.VectorTile(req)
+        layer = vtile.add_layer(name="points")
+        assert vtile.add_point(layer, 0,0,{"n":1})
+        assert vtile.add_point(layer, 0,0,{"n":2},keep_last=True)
+        assert not vtile.add_point(layer, 0,0,{"n":3})
+        self.assertEqual(len(layer.features), 1)
+        j_obj = vtile.to_geojson()
+        self.assertEqual(j_obj['features'][0]['properties'], {"n":2})
+        assert vtile.add_point(layer, 0,0,{"n":4},skip_coincident=False)
+        self.assertEqual(len(layer.features), 2)
+
+    def test_add_points_matches_add_point(self):
+        """ Test that batch point ingestion matches adding points one by one """
+        req = renderer.Request(0,0,0)
+        width = req.get_width()
+        xs = [0, width*.1, 0, width*.2, width]
+        ys = [0, width*.1, 0, -width*.2, 0]
+        props = [{"n":i, "odd":bool(i % 2), "one":[1, 1.0, True][i % 3],
+                  "name":u"caf\xe9 %d" % (i % 2), "big":-2**40 * i, "rank":i / 3.0}
+                 for i in range(len(xs))]
+        props[3] = {}
+        for keep_last in (False, True):
+            vtile = renderer.VectorTile(req)
+            layer = vtile.add_layer(name="points")
+            for x, y, p in zip(xs, ys, props):
+                if vtile.extent.intersects(x, y):
+                    vtile.add_point(layer, x, y, p, keep_last=keep_last)
+            vtile2 = renderer.VectorTile(req)
+            layer2 = vtile2.add_layer(name="points")
+            mask = vtile2.add_points(layer2, xs, ys, props, keep_last=keep_last)
+            self.assertEqual(vtile.to_geojson(), vtile2.to_geojson())
+            if keep_last:
+                self.assertEqual(list(mask), [False, True, True, True, False])
+            else:
+                self.assertEqual(vtile.to_message(), vtile2.to_message())
+                self.assertEqual(list(mask), [True, True, False, True, False])
+
+    def test_add_points_across_batches(self):
+        """ Test that points coincide with the points of earlier batches """
+        vtile = renderer.VectorTile(renderer.Request(0,0,0))
+        layer = vtile.add_layer(name="points")
+        self.assertEqual(list(vtile.add_points(layer, [0, 1e6], [0, 0], [{"a":1}, {"a":2}])),
+                         [True, True])
+        self.assertEqual(list(vtile.add_points(layer, [0, 2e6], [0, 0], [{"a":3}, {"a":4}])),
+                         [False, True])
+        mask = vtile.add_points(layer, [1e6, 3e6], [0, 0], [{"a":5}, {"a":6}], keep_last=True)
+        self.assertEqual(list(mask), [True, True])
+        self.assertEqual([f['properties']['a'] for f in vtile.to_geojson()['features']],
+                         [1, 5, 4, 6])
+        self.assertEqual([f.id for f in layer.features], [1, 2, 3, 4])
+
+    def test_add_points_bad_value(self):
+        """ Test that a failed batch leaves the interning tables as they were """
+        vtile = renderer.VectorTile(renderer.Request(0,0,0))
+        layer = vtile.add_layer(name="points")
+        vtile.add_point(layer, 0, 0, {"a":1})
+        self.assertRaises((ValueError, OverflowError), vtile.add_points, layer, [1e6, 2e6], [0, 0],
+                          [{"a":2, "b":"x"}, {"a":2**70}])
+        self.assertEqual((len(layer.features), len(layer.keys), len(layer.values)), (1, 1, 1))
+        vtile.add_points(layer, [3e6], [0], [{"b":"y", "a":1}])
+        self.assertEqual(vtile.to_geojson()['features'][1]['properties'], {"a":1, "b":"y"})
+        self.assertEqual(list(layer.keys), ["a", "b"])
+
+    def test_add_point_bad_value(self):
+        """ Test that a rejected value leaves the layer as it was """
+        vtile = renderer.VectorTile(renderer.Request(0,0,0))
+        layer = vtile.add_layer(name="points")
+        vtile.add_point(layer, 0, 0, {"a":1})
+        self.assertRaises((ValueError, OverflowError), vtile.add_point, layer, 1e6, 0,
+                          {"b":"x", "c":2**70})
+        self.assertRaises((ValueError, OverflowError), vtile.add_line, layer,
+                          [(0, 0), (1e6, 1e6)], {"c":2**70})
+        self.assertEqual((len(layer.features), len(layer.keys), len(layer.values)), (1, 1, 1))
+        self.assertRaises((ValueError, OverflowError), vtile.add_point, layer, 0, 0,
+                          {"c":2**70}, keep_last=True)
+        assert vtile.add_point(layer, 1e6, 0, {"c":5, "b":"x"})
+        self.assertEqual([f['properties'] for f in vtile.to_geojson()['features']],
+                         [{"a":1}, {"b":"x", "c":5}])
+        self.assertEqual(list(layer.keys), ["a", "c", "b"])
+
     def test_vtile_z0(self):
         """ Test adding points at zoom 0 """
         req = renderer.Request(0,0,0)
@@ -257,6 +489,777 @@ class TestTileCreation(unittest.TestCase):
         self.assertAlmostEqual(coords[0],x,4)
         self.assertAlmostEqual(coords[1],y,4)
 
+class TestGeometryDecoding(unittest.TestCase):
+    def setUp(self):
+        self.req = renderer.Request(0,0,0)
+        self.vtile = renderer.VectorTile(self.req)
+        self.layer = self.vtile.add_layer(name="shapes")
+
+    def add_feature(self, geom_type, geometry):
+        feature = self.layer.features.add()
+        feature.type = geom_type
+        feature.geometry.extend(geometry)
+        return feature
+
+    def test_decode_geometry(self):
+        # MoveTo(2,2) LineTo(+3,0) LineTo(0,+3) ClosePath
+        coords, offsets, closed = geometry.decode_geometry(
+            [9, 4, 4, 18, 6, 0, 0, 6, 15])
+        self.assertEqual(coords.tolist(), [[2,2],[5,2],[5,5]])
+        self.assertEqual(offsets.tolist(), [0,3])
+        self.assertEqual(closed.tolist(), [True])
+        self.assertRaises(ValueError, geometry.decode_geometry, [9, 4])
+
+    def test_multilinestring(self):
+        # MoveTo(0,0) LineTo(+16,0) MoveTo(+16,+16) LineTo(0,+16)
+        self.add_feature(2, [9, 0, 0, 10, 32, 0, 9, 32, 32, 10, 0, 32])
+        feature = self.vtile.to_geojson()['features'][0]
+        self.assertEqual(feature['geometry']['type'], "MultiLineString")
+        lines = feature['geometry']['coordinates']
+        self.assertEqual([len(line) for line in lines], [2, 2])
+        minx, maxy = self.req.extent.minx, self.req.extent.maxy
+        self.assertAlmostEqual(lines[1][0][0], self.vtile.ctrans.backward(2, 2)[0])
+        self.assertAlmostEqual(lines[0][0][0], minx)
+        self.assertAlmostEqual(lines[0][0][1], maxy)
+
+    def test_polygon_arrays(self):
+        feat = self.add_feature(3, [9, 4, 4, 26, 6, 0, 0, 6, 5, 0, 15])
+        coords, offsets = self.vtile.geometry_arrays(feat, lonlat=True)
+        self.assertEqual(coords.shape, (5, 2))
+        self.assertEqual(offsets.tolist(), [0, 5])
+        self.assertEqual(coords[0].tolist(), coords[-1].tolist())
+        polygon = self.vtile.to_geojson(lonlat=True)['features'][0]['geometry']
+        self.assertEqual(polygon['type'], "Polygon")
+        self.assertEqual(polygon['coordinates'], [coords.tolist()])
+
+    def test_scalar_geojson_matches_arrays(self):
+        self.add_feature(1, [17, 10, 14, 3, 9])
+        self.add_feature(2, [9, 4, 4, 18, 0, 16, 16, 0, 9, 17, 17, 10, 4, 8])
+        self.add_feature(3, [9, 0, 0, 26, 20, 0, 0, 20, 19, 0, 15,
+                             9, 4, 4, 26, 0, 10, 10, 0, 0, 9, 15])
+        scalar = self.vtile.to_geojson(lonlat=True)
+        original = renderer.SCALAR_GEOMETRY
+        renderer.SCALAR_GEOMETRY = -1
+        try:
+            arrays = self.vtile.to_geojson(lonlat=True)
+        finally:
+            renderer.SCALAR_GEOMETRY = original
+        self.assertEqual(scalar, arrays)
+        self.assertEqual([f['geometry']['type'] for f in scalar['features']],
+                         ["MultiPoint", "MultiLineString", "Polygon"])
+
+    def test_encode_geometry_roundtrip(self):
+        coords = [[2,2],[5,2],[5,5],[2,2],[-10,10],[11,-10]]
+        coords, offsets = geometry.strip_closing(
+            np.array(coords), np.array([0,4,6]), np.array([True,False]))
+        self.assertEqual(offsets.tolist(), [0,3,5])
+        encoded = geometry.encode_geometry(coords, offsets, [True,False])
+        self.assertEqual(encoded[:9].tolist(), [9, 4, 4, 18, 6, 0, 0, 6, 15])
+        decoded, offsets2, closed = geometry.decode_geometry(encoded)
+        self.assertEqual(decoded.tolist(), coords.tolist())
+        self.assertEqual(offsets2.tolist(), [0,3,5])
+        self.assertEqual(closed.tolist(), [True,False])
+
+    def test_clip_lines(self):
+        coords = np.array([[-10,5],[5,5],[5,20],[15,20],[15,5],[30,5],[8,8],[9,9]])
+        clipped, offsets = geometry.clip_lines(coords, np.array([0,6,8]), (0,0,10,10))
+        self.assertEqual(clipped.tolist(), [[0,5],[5,5],[5,10],[8,8],[9,9]])
+        self.assertEqual(offsets.tolist(), [0,3,5])
+
+    def test_clip_polygons(self):
+        coords = np.array([[-5,-5],[15,-5],[15,15],[-5,15],[2,2],[3,2],[3,3],[20,20],[30,20],[30,30]])
+        clipped, offsets = geometry.clip_polygons(coords, np.array([0,4,7,10]), (0,0,10,10))
+        self.assertEqual(clipped.tolist(), [[0,10],[0,0],[10,0],[10,10],[2,2],[3,2],[3,3]])
+        self.assertEqual(offsets.tolist(), [0,4,7])
+
+    def test_add_clipped_geometry(self):
+        ctrans = self.vtile.ctrans
+        line = [ctrans.backward(x, y) for x, y in ((-100, 100), (400, 100))]
+        f = self.vtile.add_line(self.layer, line, {})
+        coords, _, _ = geometry.decode_geometry(f.geometry)
+        self.assertEqual(coords[:,0].tolist(), [-8*16, 264*16])
+        outside = [ctrans.backward(x, y) for x, y in ((300, 300), (400, 300), (400, 400))]
+        assert self.vtile.add_polygon(self.layer, [outside], {}) is None
+        self.assertEqual(len(self.layer.features), 1)
+        vtile = renderer.VectorTile(self.req, buffer=None)
+        f = vtile.add_line(vtile.add_layer("lines"), line, {})
+        coords, _, _ = geometry.decode_geometry(f.geometry)
+        self.assertEqual(coords[:,0].tolist(), [-100*16, 400*16])
+
+    def test_simplify(self):
+        coords = np.array([[0,0],[0,0],[5,1],[10,0],[10,10],[11,10],[20,10]])
+        offsets = np.array([0,7])
+        coords2, offsets2, removed = geometry.prepare_parts(coords, offsets, tolerance=2)
+        self.assertEqual(coords2.tolist(), [[0,0],[10,0],[10,10],[20,10]])
+        self.assertEqual(offsets2.tolist(), [0,4])
+        self.assertEqual(removed, 3)
+        ring = np.array([[0,0],[10,0],[10,1],[10,10],[0,10],[1,1],[1,1]])
+        coords2, offsets2, removed = geometry.prepare_parts(
+            ring, np.array([0,7]), closed=True, tolerance=2)
+        self.assertEqual(coords2.tolist(), [[0,0],[10,0],[10,10],[0,10]])
+
+    def test_add_simplified_line(self):
+        vtile = renderer.VectorTile(self.req, simplify=1)
+        layer = vtile.add_layer("lines")
+        ctrans = vtile.ctrans
+        line = [ctrans.backward(x / 10.0, 5 + (x % 2) / 10.0) for x in range(100)]
+        f = vtile.add_line(layer, line, {})
+        self.assertEqual(list(f.geometry), [9, 0, 160, 10, 316, 2])
+        self.assertEqual(vtile.removed_vertices, 98)
+
+    def test_add_line_and_polygon(self):
+        ctrans = self.vtile.ctrans
+        line = [ctrans.backward(x, y) for x, y in ((1, 1), (10, 1), (10, 20))]
+        ring = [ctrans.backward(x, y) for x, y in ((1, 1), (1, 10), (10, 10), (1, 1))]
+        self.vtile.add_line(self.layer, line, {"kind":"line"})
+        self.vtile.add_polygon(self.layer, [ring], {"kind":"polygon"}, rint=True)
+        self.assertEqual(list(self.layer.features[1].geometry),
+                         [9, 32, 32, 18, 0, 288, 288, 0, 15])
+        line_json, polygon_json = self.vtile.to_geojson()['features']
+        self.assertEqual(line_json['geometry']['type'], "LineString")
+        self.assertEqual(len(line_json['geometry']['coordinates']), 3)
+        self.assertEqual(polygon_json['properties'], {"kind":"polygon"})
+        for (x, y), (x2, y2) in zip(ring, polygon_json['geometry']['coordinates'][0]):
+            self.assertAlmostEqual(x, x2, -1)
+            self.assertAlmostEqual(y, y2, -1)
+
+    def test_add_multi_geometry(self):
+        ctrans = self.vtile.ctrans
+        def ring(x0, y0, x1, y1):
+            return [ctrans.backward(x, y) for x, y in
+                    ((x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0))]
+        polygons = [[ring(1, 1, 50, 50), ring(40, 10, 10, 40)], [ring(60, 60, 70, 70)]]
+        self.vtile.add_feature(self.layer, {'type': 'MultiPolygon', 'coordinates': polygons}, {})
+        points = [ctrans.backward(1, 1), ctrans.backward(2, 2)]
+        self.vtile.add_feature(self.layer, {'type': 'MultiPoint', 'coordinates': points}, {})
+        self.assertEqual(len(self.layer.features), 2)
+        polygon_json, point_json = self.vtile.to_geojson()['features']
+        self.assertEqual(polygon_json['geometry']['type'], "MultiPolygon")
+        self.assertEqual([len(p) for p in polygon_json['geometry']['coordinates']], [2, 1])
+        self.assertEqual(point_json['geometry']['type'], "MultiPoint")
+        self.assertEqual(len(point_json['geometry']['coordinates']), 2)
+
+    def test_write_geojson(self):
+        self.add_feature(1, [9, 4, 4])
+        self.add_feature(1, [17, 4, 4, 2, 2])
+        expected = self.vtile.to_geojson(layer_names=True)
+        out = StringIO()
+        count = self.vtile.write_geojson(out, layer_names=True)
+        self.assertEqual(count, 2)
+        self.assertEqual(json.loads(out.getvalue()), expected)
+        self.assertEqual(expected['features'][1]['geometry']['type'], "MultiPoint")
+        out = StringIO()
+        renderer.write_geojson(out, self.vtile.iter_geojson_features(),
+                               newline_delimited=True)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0])['geometry']['type'], "Point")
+
+class TestTileCover(unittest.TestCase):
+    def merc(self, tx, ty, zoom):
+        """ Mercator coordinate of fractional tile coordinate tx,ty """
+        size = 2 * renderer.MAX_EXTENT / (1 << zoom)
+        return [tx * size - renderer.MAX_EXTENT, renderer.MAX_EXTENT - ty * size]
+
+    def square(self, lo, hi, zoom):
+        return [self.merc(lo,lo,zoom), self.merc(hi,lo,zoom), self.merc(hi,hi,zoom),
+                self.merc(lo,hi,zoom), self.merc(lo,lo,zoom)]
+
+    def test_point_cover(self):
+        x, y = self.merc(2.5, 5.5, 3)
+        self.assertEqual(tilecover.point_cover([x], [y], 3), set([(3, 2, 5)]))
+
+    def test_line_cover(self):
+        line = [self.merc(0.5, 0.5, 3), self.merc(2.5, 1.5, 3)]
+        self.assertEqual(tilecover.line_cover(line, 3),
+                         set([(3, 0, 0), (3, 1, 0), (3, 1, 1), (3, 2, 1)]))
+
+    def test_polygon_cover(self):
+        outer = self.square(0.5, 5.5, 3)
+        hole = self.square(1.5, 4.5, 3)
+        tiles = tilecover.polygon_cover([outer], 3)
+        self.assertEqual(len(tiles), 36)
+        tiles = tilecover.polygon_cover([outer, hole], 3)
+        self.assertEqual(len(tiles), 32)
+        assert (3, 2, 2) not in tiles and (3, 1, 1) in tiles
+        for z, x, y in tiles:
+            req = renderer.Request(x, y, z)
+            assert req.extent.intersects(*self.merc(x + .5, y + .5, z))
+
+    def test_bucket_features(self):
+        point = {'geometry': {'type': 'Point', 'coordinates': self.merc(1.5, 1.5, 2)}}
+        line = {'geometry': {'type': 'LineString',
+                             'coordinates': [self.merc(0.5, 1.5, 2), self.merc(1.5, 1.5, 2)]}}
+        buckets = tilecover.bucket_features([point, line, {'geometry': None}], 2)
+        self.assertEqual(buckets, {(2, 0, 1): [line], (2, 1, 1): [line, point]})
+        # a buffer adds the tiles a feature comes close to
+        line['geometry']['coordinates'][1] = self.merc(1.98, 1.5, 2)
+        buckets = tilecover.bucket_features([point, line], 2, buffer=0.05)
+        self.assertEqual(buckets, {(2, 0, 1): [line], (2, 1, 1): [line, point],
+                                   (2, 2, 1): [line]})
+
+class TestPyramid(unittest.TestCase):
+    def test_build_pyramid(self):
+        points = [(-8526703.37, 4740318.74), (13358338.89, -3503549.84), (1000.0, 1000.0)]
+        features = [{'geometry': {'type': 'Point', 'coordinates': list(p)},
+                     'properties': {'n': i}} for i, p in enumerate(points)]
+        tiles = dict(((z, x, y), data) for z, x, y, data in
+                     pyramid.build_pyramid(features, 0, 2, processes=1))
+        self.assertEqual(len([t for t in tiles if t[0] == 0]), 1)
+        self.assertEqual(len([t for t in tiles if t[0] == 2]), 3)
+        counts = {}
+        for (z, x, y), data in tiles.items():
+            tile = vector_tile_pb2.Tile()
+            tile.ParseFromString(data)
+            self.assertEqual(tile.layers[0].name, 'features')
+            counts[z] = counts.get(z, 0) + len(tile.layers[0].features)
+        self.assertEqual(counts, {0: 3, 1: 3, 2: 3})
+        pooled = dict(((z, x, y), data) for z, x, y, data in
+                      pyramid.build_pyramid(features, 0, 2, processes=2))
+        self.assertEqual(tiles, pooled)
+
+    def test_buffer_across_seams(self):
+        size = 2 * renderer.MAX_EXTENT
+        # ends just short of the edge between tiles 0 and 1 of zoom 1
+        line = {'geometry': {'type': 'LineString',
+                             'coordinates': [[-size * .3, size * .25], [-size * .005, size * .25]]},
+                'properties': {}}
+        tiles = dict(((z, x, y), data) for z, x, y, data in
+                     pyramid.build_pyramid([line], 1, 1, processes=1))
+        self.assertEqual(sorted(tiles), [(1, 0, 0), (1, 1, 0)])
+        tiles = dict(((z, x, y), data) for z, x, y, data in
+                     pyramid.build_pyramid([line], 1, 1, processes=1, buffer=0))
+        self.assertEqual(sorted(tiles), [(1, 0, 0)])
+
+class TestReader(unittest.TestCase):
+    def test_reader_matches_protobuf(self):
+        req = renderer.Request(0,0,0)
+        vtile = renderer.VectorTile(req)
+        width = req.get_width()
+        for name in ("points", "more"):
+            layer = vtile.add_layer(name=name)
+            vtile.add_point(layer, 0, 0, {"name":u"élan", "n":-3, "f":1.5, "b":False})
+            vtile.add_point(layer, width*.1, width*.1, {"n":sys.maxsize})
+        layer.features[0].type = 0
+        layer.values.add().sint_value = -7
+        layer.values.add().float_value = 0.25
+        data = vtile.to_message()
+        reader = TileReader(data)
+        self.assertEqual(reader.layer_names(), ["points", "more"])
+        assert reader.layer("missing") is None
+        for layer, lazy in zip(vtile.tile.layers, reader.layers):
+            self.assertEqual(len(lazy), len(layer.features))
+            self.assertEqual((lazy.version, lazy.extent), (layer.version, layer.extent))
+            self.assertEqual(lazy.keys, list(layer.keys))
+            self.assertEqual(lazy.values, [renderer.decode_value(v) for v in layer.values])
+            for feat, lazy_feat in zip(layer.features, lazy.features):
+                self.assertEqual(lazy_feat.id, feat.id)
+                self.assertEqual(lazy_feat.type, feat.type)
+                self.assertEqual(lazy_feat.tags, list(feat.tags))
+                self.assertEqual(lazy_feat.geometry, list(feat.geometry))
+        self.assertEqual(bytes(reader.layers[1].raw()),
+                         vtile.tile.layers[1].SerializeToString())
+
+    def test_reader_field_order(self):
+        """ Test indexing layers whose fields are long or interleaved """
+        layer = vector_tile_pb2.Tile.Layer()
+        layer.name = "mixed"
+        layer.version = 2
+        short = vector_tile_pb2.Tile.Feature(id=1, type=1, geometry=[9, 2, 2])
+        long_line = vector_tile_pb2.Tile.Feature(id=2, type=2, geometry=[9, 0, 0, 8 * 100 + 2] + [2] * 200)
+        data = b''
+        for field, message in ((2, short), (3, "a"), (2, long_line), (4, u"x" * 300), (2, short)):
+            part = vector_tile_pb2.Tile.Layer()
+            if field == 2:
+                part.features.add().CopyFrom(message)
+            elif field == 3:
+                part.keys.append(message)
+            else:
+                part.values.add().string_value = message
+            data += part.SerializePartialToString()
+        data += layer.SerializeToString()
+        tile = vector_tile_pb2.Tile()
+        tile.layers.add().ParseFromString(data)
+        lazy = TileReader(tile.SerializeToString()).layers[0]
+        self.assertEqual([f.id for f in lazy.features], [1, 2, 1])
+        self.assertEqual(lazy.features[1].geometry, list(long_line.geometry))
+        self.assertEqual((lazy.name, lazy.version, lazy.keys), ("mixed", 2, ["a"]))
+        self.assertEqual(lazy.values, [u"x" * 300])
+        data = memoryview(tile.layers[0].SerializeToString())
+        self.assertRaises(ValueError, len, LayerReader(data, 0, len(data) - 1))
+
+class TestLayerEncoding(unittest.TestCase):
+    def test_layer(self):
+        features = [
+            {'geometry': {'type': 'Point', 'coordinates': [10, 20]},
+             'properties': {'a': 0, 'b': False, 'c': 'x'}},
+            {'geometry': {'type': 'LineString', 'coordinates': [[0, 0], [5, 0], [5, -5]]},
+             'properties': {'a': 0, 'b': 0}},
+            {'geometry': {'type': 'Polygon', 'coordinates': [[[0, 0], [4, 0], [4, 4], [0, 0]]]},
+             'properties': {}}]
+        pbl = vector_tile.layer("shapes", features)
+        self.assertEqual(pbl.name, "shapes")
+        self.assertEqual(len(pbl.features), 3)
+        self.assertEqual(list(pbl.keys), ['a', 'b', 'c'])
+        self.assertEqual([renderer.decode_value(v) for v in pbl.values], [0, False, 'x'])
+        self.assertEqual(list(pbl.features[0].tags), [0, 0, 1, 1, 2, 2])
+        self.assertEqual(list(pbl.features[1].tags), [0, 0, 1, 0])
+        self.assertEqual(list(pbl.features[0].geometry), [9, 20, 40])
+        self.assertEqual(list(pbl.features[1].geometry), [9, 0, 0, 18, 10, 0, 0, 9])
+        self.assertEqual(pbl.features[2].type, 3)
+        self.assertEqual(list(pbl.features[2].geometry)[-1], 15)
+        tile = vector_tile.tile([pbl])
+        self.assertEqual(len(tile.layers), 1)
+
+    def test_layer_unknown_geometry(self):
+        features = [{'geometry': {'type': 'GeometryCollection', 'coordinates': []},
+                     'properties': {}}]
+        self.assertRaises(ValueError, vector_tile.layer, "shapes", features)
+
+    def test_layer_multi_geometry(self):
+        features = [
+            {'geometry': {'type': 'MultiPoint', 'coordinates': [[1, 1], [3, 2]]},
+             'properties': {'a': 1}},
+            {'geometry': {'type': 'MultiPolygon', 'coordinates': [
+                [[[0, 0], [4, 0], [4, 4], [0, 0]]],
+                [[[8, 8], [9, 8], [9, 9], [8, 8]]]]},
+             'properties': {'a': 1}}]
+        pbl = vector_tile.layer("shapes", features)
+        self.assertEqual(len(pbl.features), 2)
+        self.assertEqual(list(pbl.features[0].geometry), [17, 2, 2, 4, 2])
+        self.assertEqual(list(pbl.features[1].geometry).count(9), 2)
+        self.assertEqual(len(pbl.values), 1)
+        exploded = vector_tile.layer("shapes", features, explode=True)
+        self.assertEqual(len(exploded.features), 4)
+
+    def test_layer_clipping(self):
+        features = [
+            {'geometry': {'type': 'LineString', 'coordinates': [[-100, 10], [100, 10]]}},
+            {'geometry': {'type': 'Point', 'coordinates': [5000, 10]}},
+            {'geometry': {'type': 'MultiPoint', 'coordinates': [[5000, 10], [10, 10]]}}]
+        stats = Stats()
+        pbl = vector_tile.layer("shapes", features, buffer=64, simplify=1, stats=stats)
+        self.assertEqual(stats.counters, {'removed_vertices': 0, 'vertices': 3, 'features': 2,
+                                          'dropped_features': 1, 'keys': 0, 'values': 0})
+        self.assertEqual(sorted(stats.timers), ['attributes', 'encoding', 'geometry'])
+        self.assertEqual([f.id for f in pbl.features], [0, 2])
+        self.assertEqual(list(pbl.features[0].geometry), [9, 127, 20, 10, 328, 0])
+        self.assertEqual(list(pbl.features[1].geometry), [9, 20, 20])
+
+class TestStats(unittest.TestCase):
+    def test_vector_tile(self):
+        exported = []
+        req = renderer.Request(0,0,0)
+        start = clock()
+        with Stats(callback=exported.append) as stats:
+            vtile = renderer.VectorTile(req, stats=stats)
+            layer = vtile.add_layer("points")
+            vtile.add_point(layer,0,0,{"name":"a"})
+            vtile.add_point(layer,0,0,{"name":"b"})
+            vtile.add_points(layer,[0,10,1e6],[0,10,1e6],[{"name":"c"}]*3)
+            vtile.add_line(vtile.add_layer("lines"),[[0,0],[0,0],[1e6,0],[2e6,0]],{"name":"a"})
+            with stats.timer('total'):
+                data = vtile.to_message(compression='gzip')
+            renderer.VectorTile.from_message(req, data, stats=stats)
+        wall = clock() - start
+        counters = exported[0]['counters']
+        self.assertEqual(counters, {'features': 4, 'vertices': 6, 'coincident_dropped': 2,
+                                    'removed_vertices': 1, 'keys': 2, 'values': 3})
+        self.assertEqual(sorted(exported[0]['timers']), [
+            'attributes', 'compression', 'dedup', 'encoding', 'geometry', 'parsing',
+            'projection', 'quantization', 'serialization', 'total'])
+        self.assertGreaterEqual(stats.timers['total'],
+                                stats.timers['serialization'] + stats.timers['compression'])
+        # stages never overlap, so they add up to at most the wall time
+        stages = dict(stats.timers)
+        del stages['total']
+        for seconds in stages.values():
+            self.assertGreaterEqual(seconds, 0)
+        self.assertLessEqual(sum(stages.values()), wall)
+        stats.reset()
+        self.assertEqual((stats['features'], stats.timers), (0, {}))
+
+class TestLazyTile(unittest.TestCase):
+    def setUp(self):
+        self.req = renderer.Request(0,0,0)
+        vtile = renderer.VectorTile(self.req)
+        roads = vtile.add_layer("roads")
+        for i in range(50):
+            vtile.add_line(roads,[[i*1e5,0],[i*1e5,1e6]],{"id":i,"class":"road%d" % (i % 5)})
+        points = vtile.add_layer("points")
+        vtile.add_point(points,0,0,{"name":"null island"})
+        self.vtile = vtile
+        self.data = vtile.to_message(compression='gzip')
+
+    def test_whole_tile(self):
+        lazy = renderer.VectorTile.from_bytes(self.req, self.data)
+        self.assertEqual(lazy.to_geojson(layer_names=True),
+                         self.vtile.to_geojson(layer_names=True))
+
+    def test_selected_layers(self):
+        lazy = renderer.VectorTile.from_bytes(self.req, self.data, layers=["roads"])
+        self.assertEqual([layer.name for layer in lazy.tile.layers], ["roads"])
+        assert lazy.layer("points") is None
+        features = lazy.features("roads", lonlat=True)
+        self.assertEqual(len(features), 50)
+        expected = list(self.vtile.iter_geojson_features(self.vtile.layer("roads"), lonlat=True))
+        self.assertEqual(features[:10], expected[:10])
+        self.assertEqual(features[-1], expected[-1])
+        # only the values of the features read were decoded
+        roads = lazy.layer("roads")
+        assert roads._values is None
+        self.assertEqual(len(roads._value_cache), 10 + 5 + 1)
+        self.assertRaises(KeyError, lazy.features, "points")
+        self.assertEqual(list(lazy.features("roads")), self.vtile.to_geojson("roads")['features'])
+
+    def test_empty_layer(self):
+        self.vtile.add_layer("empty")
+        lazy = renderer.VectorTile.from_bytes(self.req, self.vtile.to_message())
+        empty = lazy.layer("empty")
+        self.assertEqual(len(empty), 0)
+        # an empty layer is falsy but still selects only itself
+        self.assertEqual(lazy.to_geojson(empty)['features'], [])
+        self.assertEqual(list(lazy.query(layer=empty)), [])
+
+class TestQuery(unittest.TestCase):
+    def setUp(self):
+        self.req = renderer.Request(0,0,0)
+        vtile = renderer.VectorTile(self.req)
+        roads = vtile.add_layer("roads")
+        for i in range(20):
+            props = {"id":i,"class":["motorway","primary","path"][i % 3],"oneway":i % 2 == 1}
+            vtile.add_line(roads,[[i*1e5,0],[i*1e5,1e6]],props)
+        vtile.add_line(roads,[[0,0],[1e6,1e6]],{"id":1.0})
+        vtile.add_point(vtile.add_layer("points"),0,0,{"class":"motorway"})
+        self.vtile = vtile
+        self.data = vtile.to_message()
+
+    def ids(self, vtile, **kwargs):
+        return [f['properties'].get('id') for f in vtile.query(**kwargs)]
+
+    def test_query(self):
+        for vtile in (self.vtile, renderer.VectorTile.from_bytes(self.req, self.data)):
+            self.assertEqual(self.ids(vtile, where={"class":"motorway"}, layer="roads"),
+                             [0, 3, 6, 9, 12, 15, 18])
+            self.assertEqual(self.ids(vtile, where={"class":("path","primary"),"oneway":True}),
+                             [1, 5, 7, 11, 13, 17, 19])
+            # booleans only match booleans, other values compare as numbers
+            self.assertEqual(self.ids(vtile, where={"id":1}), [1, 1.0])
+            self.assertEqual(self.ids(vtile, where={"oneway":1}), [])
+            self.assertEqual(self.ids(vtile, where={"id":lambda v: v >= 18}), [18, 19])
+            self.assertEqual(self.ids(vtile, where={"missing":1}), [])
+            found = list(vtile.query(where={"class":"motorway"}, properties=["class"],
+                                     layer_names=True))
+            self.assertEqual(len(found), 8)
+            self.assertEqual(found[-1]['properties'], {"class":"motorway","layer":"points"})
+            self.assertEqual(found[0]['geometry'],
+                             self.vtile.to_geojson("roads")['features'][0]['geometry'])
+
+    def test_empty_value(self):
+        tile = vector_tile_pb2.Tile()
+        tile.ParseFromString(self.data)
+        points = tile.layers[1]
+        points.values.add()
+        points.features[0].tags[1] = len(points.values) - 1
+        vtile = renderer.VectorTile(self.req, tile)
+        for vtile in (vtile, renderer.VectorTile.from_bytes(self.req, tile.SerializeToString())):
+            self.assertEqual(list(vtile.query(where={"class":"motorway"}, layer="points")), [])
+            self.assertEqual(list(vtile.query(where={"class":lambda v: v is not None},
+                                              layer="points")), [])
+
+    def test_skips_without_decoding(self):
+        lazy = renderer.VectorTile.from_bytes(self.req, self.data, layers=["roads"])
+        decoded = []
+        geometry_arrays = lazy.geometry_arrays
+        lazy.geometry_arrays = lambda f, **kw: decoded.append(f) or geometry_arrays(f, **kw)
+        geometry_parts = lazy._geometry_parts
+        lazy._geometry_parts = lambda f, *a: decoded.append(f) or geometry_parts(f, *a)
+        calls = []
+        found = list(lazy.query(where={"id":lambda v: calls.append(v) or v == 4}))
+        self.assertEqual([f['properties']['id'] for f in found], [4])
+        self.assertEqual(len(decoded), 1)
+        # each distinct value is tested once
+        self.assertEqual(sorted(calls, key=float), sorted(list(range(20)) + [1.0]))
+        # the packed geometry of skipped features is never read
+        feature = lazy.layer("roads").features[0]
+        feature.tags
+        assert feature._geometry is None
+
+    def test_layer_query(self):
+        bound = query.Query({"a":"x"}, ["b"]).resolve(["b","a"], ["x","y"])
+        self.assertEqual(bound.keep, frozenset([0]))
+        assert bound.matches([0,1,1,0])
+        assert not bound.matches([0,0,1,1])
+        assert not bound.matches([0,0])
+        assert query.Query({"a":"z"}).resolve(["a"], ["x"]) is None
+        # a key listed twice in the layer's keys is matched at either index
+        bound = query.Query({"a":"x","b":"y"}, ["a"]).resolve(["a","b","a"], ["x","y"])
+        self.assertEqual(bound.keep, frozenset([0, 2]))
+        assert bound.matches([0,0,1,1])
+        assert bound.matches([2,0,1,1])
+        assert not bound.matches([2,1,1,1])
+        assert not bound.matches([2,0])
+
+class TestMBTiles(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'tiles.mbtiles')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write_and_read(self):
+        tiles = [(2, x, y, b'empty') for x in range(4) for y in range(4)]
+        tiles.append((2, 1, 2, b'land'))
+        with MBTiles(self.path, 'w') as mbtiles:
+            self.assertEqual(mbtiles.write_tiles(iter(tiles), batch_size=5), 17)
+            mbtiles.set_metadata({'name': 'test'})
+            images = mbtiles.conn.execute("SELECT count(*) FROM images").fetchone()[0]
+            self.assertEqual(images, 2)
+            vtile = renderer.VectorTile(renderer.Request(0, 0, 0))
+            vtile.add_point(vtile.add_layer("points"), 0, 0, {"hello":"world"})
+            mbtiles.write_vector_tile(vtile)
+        with MBTiles(self.path) as mbtiles:
+            self.assertEqual(mbtiles.metadata(), {'name': 'test', 'format': 'pbf'})
+            self.assertEqual(mbtiles.get_tile(2, 1, 2), b'land')
+            self.assertEqual(mbtiles.get_request(renderer.Request(3, 0, 2)), b'empty')
+            assert mbtiles.get_tile(3, 0, 0) is None
+            row = mbtiles.conn.execute(
+                "SELECT tile_row FROM map WHERE zoom_level = 2 AND tile_column = 1 "
+                "AND tile_id = ?", (hashlib.md5(b'land').hexdigest(),)).fetchone()
+            self.assertEqual(row[0], 1)
+            found = sorted(mbtiles.get_tiles(2, 1, 2, 2, 3))
+            self.assertEqual([t[:3] for t in found], [(2, 1, 2), (2, 1, 3), (2, 2, 2), (2, 2, 3)])
+            vtile2 = mbtiles.get_vector_tile(renderer.Request(0, 0, 0))
+            self.assertEqual(vtile2.to_geojson(), vtile.to_geojson())
+            self.assertRaises(sqlite3.OperationalError, mbtiles.write_tiles,
+                              [(0, 0, 0, b'new')])
+
+    def test_read_missing(self):
+        path = os.path.join(self.tmpdir, 'missing?#%.mbtiles')
+        self.assertRaises(sqlite3.OperationalError, MBTiles, path)
+        assert not os.listdir(self.tmpdir)
+
+    def test_read_without_uri(self):
+        with MBTiles(self.path, 'w') as mbtiles:
+            mbtiles.write_tiles([(0, 0, 0, b'land')])
+        uri_connect = mbtiles_module.URI_CONNECT
+        mbtiles_module.URI_CONNECT = False
+        try:
+            with MBTiles(self.path) as mbtiles:
+                self.assertEqual(mbtiles.get_tile(0, 0, 0), b'land')
+                self.assertRaises(sqlite3.OperationalError, mbtiles.write_tiles,
+                                  [(0, 0, 0, b'new')])
+            self.assertRaises(sqlite3.OperationalError, MBTiles,
+                              os.path.join(self.tmpdir, 'missing.mbtiles'))
+        finally:
+            mbtiles_module.URI_CONNECT = uri_connect
+        assert 'missing.mbtiles' not in os.listdir(self.tmpdir)
+
+class TestArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'tiles.vta')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_hilbert_index(self):
+        self.assertEqual([archive.hilbert_index(1, x, y) for x, y in
+                          ((0, 0), (0, 1), (1, 1), (1, 0))], [0, 1, 2, 3])
+
+    def test_write_and_read(self):
+        vtile = renderer.VectorTile(renderer.Request(0, 0, 0))
+        vtile.add_point(vtile.add_layer("points"), 0, 0, {"hello":"world"})
+        tiles = [(3, x, y, b'empty') for x in range(8) for y in range(8)]
+        tiles += [(3, 5, 2, b'land'), (0, 0, 0, vtile.to_message(compression='gzip'))]
+        archive.write_archive(self.path, tiles)
+        with archive.Archive(self.path) as tiles:
+            self.assertEqual(len(tiles), 65)
+            tile = tiles.get_tile(3, 5, 2)
+            self.assertEqual(bytes(tile), b'land')
+            tile.release()
+            tile = tiles.get_request(renderer.Request(7, 7, 3))
+            self.assertEqual(bytes(tile), b'empty')
+            tile.release()
+            assert tiles.get_tile(4, 0, 0) is None
+            self.assertEqual(list(tiles)[:2], [(0, 0, 0), (3, 0, 0)])
+            vtile2 = tiles.get_vector_tile(renderer.Request(0, 0, 0))
+            self.assertEqual(vtile2.to_geojson(), vtile.to_geojson())
+        # identical blobs are stored once
+        self.assertLess(os.path.getsize(self.path), 8 + 28 * 65 + 4 * 5 + 200)
+
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.req = renderer.Request(0,0,0)
+        vtile = renderer.VectorTile(self.req)
+        vtile.add_point(vtile.add_layer("points"),0,0,{"name":"null island"})
+        vtile.add_point(vtile.add_layer("other"),10,10,{"name":"elsewhere"})
+        self.vtile = vtile
+        self.data = vtile.to_message(compression='gzip')
+
+    def test_hits(self):
+        tiles = cache.TileCache()
+        jobj = tiles.geojson(self.req,self.data)
+        self.assertEqual(jobj,self.vtile.to_geojson())
+        self.assertEqual(tiles.stats()['misses'],3)
+        self.assertIs(tiles.geojson(self.req,self.data),jobj)
+        self.assertEqual(tiles.stats()['hits'],1)
+        self.assertIs(tiles.vector_tile(self.req,self.data).tile,tiles.tile(self.data))
+        self.assertEqual(tiles.stats()['hits'],3)
+        points = tiles.geojson(self.req,self.data,layer="points")
+        self.assertEqual([f['properties']['name'] for f in points['features']],['null island'])
+        self.assertEqual(tiles.geojson(self.req,self.data,layer="missing")['features'],[])
+        # another request decodes the same parsed tile differently
+        other = tiles.geojson(renderer.Request(1,1,1),self.data)
+        self.assertNotEqual(other,jobj)
+        self.assertEqual(len(tiles),7)
+
+    def test_eviction(self):
+        raw = len(self.vtile.to_message())
+        tiles = cache.TileCache(maxbytes=raw * cache.PARSED_OVERHEAD)
+        tiles.tile(self.data)
+        self.assertEqual(tiles.nbytes,raw * cache.PARSED_OVERHEAD)
+        tiles.tile(self.vtile.to_message())
+        self.assertEqual((len(tiles),tiles.evictions),(1,1))
+        # entries larger than the whole cache are not kept
+        tiles.vector_tile(self.req,self.data)
+        self.assertEqual(tiles.nbytes,raw * cache.PARSED_OVERHEAD)
+        tiles.clear()
+        self.assertEqual((len(tiles),tiles.nbytes),(0,0))
+
+@unittest.skipIf(bench_runner is None, "benchmarks need Python 3.5+")
+class TestBenchmarks(unittest.TestCase):
+    def test_data_is_repeatable(self):
+        req = bench_data.request('z14')
+        xs, ys = bench_data.dense_points(req, 100)
+        self.assertTrue(np.array_equal(xs, bench_data.dense_points(req, 100)[0]))
+        assert req.extent.intersects(xs[0], ys[0])
+        polygons = bench_data.many_ring_polygons(req, 2, 3, 8)
+        self.assertEqual(polygons, bench_data.many_ring_polygons(req, 2, 3, 8))
+        self.assertEqual([len(p) for p in polygons], [3, 3])
+        self.assertEqual(polygons[0][0][0], polygons[0][0][-1])
+
+    def test_cases_run(self):
+        result = bench_runner.measure('vtile.add_point.z7', scale=0.01, repeat=1)
+        self.assertEqual(result['ops'], 50)
+        self.assertGreater(result['throughput'], 0)
+        self.assertGreater(result['alloc_peak'], 0)
+
+    def test_compare(self):
+        base = {'results': {'a': {'throughput': 100.0, 'alloc_peak': 1000},
+                            'b': {'throughput': 100.0, 'alloc_peak': 1000}}}
+        result = {'results': {'a': {'throughput': 80.0, 'alloc_peak': 1050},
+                              'b': {'throughput': 95.0, 'alloc_peak': 2000},
+                              'c': {'throughput': 1.0, 'alloc_peak': 1}}}
+        rows = bench_runner.compare(base, result, threshold=0.1)
+        self.assertEqual([(r[0], r[1], r[-1]) for r in rows],
+                         [('a', 'throughput', True), ('a', 'alloc_peak', False),
+                          ('b', 'throughput', False), ('b', 'alloc_peak', True)])
+
+@unittest.skipIf(server is None, "server needs Python 3.5+")
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        req = renderer.Request(0,0,0)
+        vtile = renderer.VectorTile(req)
+        vtile.add_point(vtile.add_layer("points"),0,0,{"name":"null island"})
+        self.data = vtile.to_message(compression='gzip')
+
+    def tearDown(self):
+        self.loop.close()
+
+    def make_service(self, **kwargs):
+        asyncio.set_event_loop(self.loop)
+        # 1/0/0 is truncated
+        tiles = {(0,0,0): self.data, (1,0,0): compression.decompress(self.data)[:-3]}
+        return server.TileService(server.DictStore(tiles), **kwargs)
+
+    def test_parse_path(self):
+        req, ext = server.parse_path('/3/2/5.geojson?foo=bar')
+        self.assertEqual((req.zoom,req.x,req.y,ext),(3,2,5,'geojson'))
+        for path in ('/3/2.mvt','/1/2/0.mvt','/0/0/0.png'):
+            self.assertRaises(ValueError,server.parse_path,path)
+
+    def test_directory_store(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            os.makedirs(os.path.join(tmpdir,'0','0'))
+            with open(os.path.join(tmpdir,'0','0','0.mvt'),'wb') as f:
+                f.write(self.data)
+            store = server.DirectoryStore(tmpdir)
+            self.assertEqual(store.get_tile(0,0,0),self.data)
+            self.assertEqual(store.get_tile(1,0,0),None)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_coalesce(self):
+        service = self.make_service()
+        calls = []
+        get_tile = service.store.get_tile
+        service.store.get_tile = lambda z,x,y: calls.append((z,x,y)) or get_tile(z,x,y)
+        req = renderer.Request(0,0,0)
+        async def run():
+            return await asyncio.gather(*[service.get(req,'geojson') for _ in range(5)])
+        results = self.loop.run_until_complete(run())
+        self.assertEqual(calls,[(0,0,0)])
+        self.assertEqual(len(set(body for _,_,body in results)),1)
+        self.assertEqual(service._inflight,{})
+
+    def test_busy(self):
+        service = self.make_service(max_workers=1,max_waiting=0)
+        async def run():
+            first = asyncio.ensure_future(service.get(renderer.Request(0,0,0)))
+            await asyncio.sleep(0)
+            with self.assertRaises(server.ServiceBusy):
+                await service.get(renderer.Request(0,0,1))
+            return await first
+        content_type, headers, body = self.loop.run_until_complete(run())
+        self.assertEqual(body,self.data)
+
+    def test_cache_with_processes(self):
+        from concurrent.futures import ProcessPoolExecutor
+        tiles = cache.TileCache()
+        with ProcessPoolExecutor(1) as executor:
+            service = self.make_service(executor=executor, cache=tiles)
+            req = renderer.Request(0,0,0)
+            first = self.loop.run_until_complete(service.get(req,'geojson'))
+            second = self.loop.run_until_complete(service.get(req,'geojson'))
+        self.assertEqual(first,second)
+        self.assertEqual((tiles.stats()['hits'],len(tiles)),(1,1))
+        features = json.loads(first[2].decode('utf-8'))['features']
+        self.assertEqual(features[0]['properties']['name'],'null island')
+
+    def test_http(self):
+        service = self.make_service()
+        async def fetch(port, path):
+            reader, writer = await asyncio.open_connection('127.0.0.1',port)
+            writer.write(('GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n' % path).encode('ascii'))
+            response = await reader.read()
+            writer.close()
+            head, body = response.split(b'\r\n\r\n',1)
+            return head.decode('latin-1').split('\r\n'), body
+        async def run():
+            srv = await service.serve(port=0)
+            port = srv.sockets[0].getsockname()[1]
+            try:
+                return [await fetch(port,path) for path in
+                        ('/0/0/0.mvt','/0/0/0.geojson','/1/1/0.mvt','/foo',
+                         '/1/0/0.geojson')]
+            finally:
+                srv.close()
+                await srv.wait_closed()
+        mvt, geojson, missing, bad, broken = self.loop.run_until_complete(run())
+        self.assertEqual(mvt[0][0],'HTTP/1.1 200 OK')
+        self.assertIn('Content-Encoding: gzip',mvt[0])
+        self.assertEqual(mvt[1],self.data)
+        self.assertEqual(geojson[0][0],'HTTP/1.1 200 OK')
+        features = json.loads(geojson[1].decode('utf-8'))
+        self.assertEqual(features['features'][0]['properties']['name'],'null island')
+        self.assertEqual(missing[0][0],'HTTP/1.1 404 Not Found')
+        self.assertEqual(bad[0][0],'HTTP/1.1 404 Not Found')
+        self.assertEqual(broken[0][0],'HTTP/1.1 500 Internal Server Error')
 
 if __name__ == '__main__':
     unittest.main()
@@ -6,7 +6,6 @@ from __future__ import print_function
 import sys
 import json
 from vector_tile import renderer
-from vector_tile import vector_tile_pb2
 
 from optparse import OptionParser
 
@@ -25,6 +24,10 @@ if __name__ == "__main__" :
     parser.add_option("-t", type="string", dest="tile_address", default=None)
     parser.add_option("-l", "--layer", dest="layer", default=None)
     parser.add_option("-v", "--verbose", action="store_true", dest="verbose")
+    parser.add_option("-s", "--stream", action="store_true", dest="stream",
+        help="write features one at a time instead of building the whole collection")
+    parser.add_option("--ndjson", action="store_true", dest="ndjson",
+        help="stream newline-delimited GeoJSON features (implies --stream)")
     (options, args) = parser.parse_args()
 
     if len(args) != 1:
@@ -48,19 +51,19 @@ if __name__ == "__main__" :
     if options.verbose:
         stderr("opening %s as tile %d/%d/%d" % (filename, zoom, x, y))
     with open(filename, "rb") as f:
-        tile = vector_tile_pb2.Tile()
-        decoded = f.read()
-
-        tile.ParseFromString(decoded)
         req = renderer.Request(x,y,zoom)
-        vtile = renderer.VectorTile(req, tile)
-        vtile.layer = tile.Layer
+        # layers are only indexed when they are read
+        vtile = renderer.VectorTile.from_bytes(req, f.read())
+        tile = vtile.tile
+        layer = vtile.layer(options.layer) if options.layer else None
 
-        if options.layer:
-            for layer in tile.layers:
-                if layer.name == options.layer:
-                    print(vtile.to_geojson(layer=layer, lonlat=True, layer_names=True))
-                    break
+        if options.stream or options.ndjson:
+            if not options.layer or layer is not None:
+                vtile.write_geojson(sys.stdout, layer=layer, lonlat=True,
+                    layer_names=True, newline_delimited=options.ndjson)
+        elif options.layer:
+            if layer is not None:
+                print(vtile.to_geojson(layer=layer, lonlat=True, layer_names=True))
         else:
             print(json.dumps(vtile.to_geojson(lonlat=True, layer_names=True), indent=4))
 
@@ -6,6 +6,8 @@ from __future__ import print_function
 import sys
 import codecs
 from vector_tile import vector_tile_pb2
+from vector_tile.compression import decompress
+from vector_tile.reader import TileReader
 from optparse import OptionParser
 
 
@@ -42,6 +44,9 @@ if __name__ == "__main__":
         description="Output information in a Mapnik vector tile.")
     parser.add_option("-v", "--verbose", action="store_true",
                       dest="verbose", default=False)
+    parser.add_option("-l", "--layers", action="store_true",
+                      dest="layers", default=False,
+                      help="only list layer names and feature counts")
     (options, args) = parser.parse_args()
 
     if len(args) != 1:
@@ -49,9 +54,18 @@ if __name__ == "__main__":
         sys.exit(0)
 
     filename = args[0]
+    if options.layers:
+        # the lazy reader never decodes the features it counts
+        with open(filename, "rb") as f:
+            reader = TileReader(decompress(f.read()))
+            stderr("layers: {}".format(len(reader.layers)))
+            for layer in reader.layers:
+                stderr("{}: {} features".format(layer.name, len(layer)))
+        sys.exit(0)
+
     with open(filename, "rb") as f:
         tile = vector_tile_pb2.Tile()
-        decoded = f.read()
+        decoded = decompress(f.read())
 
         tile.ParseFromString(decoded)
 
@@ -9,7 +9,11 @@ except ImportError:
     # Python 3
     pass
 
+import numpy as np
+
+from vector_tile import geometry
 from vector_tile import vector_tile_pb2
+from vector_tile.stats import clock
 
 
 __version__ = "0.1"
@@ -19,7 +23,10 @@ geom_type_map = {
     'Unknown': 0,
     'Point': 1,
     'LineString': 2,
-    'Polygon': 3 }
+    'Polygon': 3,
+    'MultiPoint': 1,
+    'MultiLineString': 2,
+    'MultiPolygon': 3 }
 
 if sys.version_info.major == 3:
     value_type_map = {
@@ -36,10 +43,29 @@ else:
         bool: 'bool_value' }
 
 def value(ob):
-    v = vector_tile_pb2.Tile.value()
+    v = vector_tile_pb2.Tile.Value()
     setattr(v, value_type_map[type(ob)], ob)
     return v
 
+def parts_geometry(parts, closed=False, clip=None, tolerance=None, stats=None):
+    """Encode a sequence of coordinate sequences as one command stream.
+
+    clip is an optional (minx, miny, maxx, maxy) box in tile coordinates
+    to clip lines, or rings when closed, to and tolerance an optional
+    simplification tolerance in tile units. Vertices kept and dropped
+    are counted as 'vertices' and 'removed_vertices' in the optional
+    stats.Stats.
+    """
+    arrays = [np.asarray(part, dtype=np.float64).reshape(-1, 2) for part in parts]
+    coords = np.concatenate(arrays).astype(np.int64)
+    offsets = np.concatenate(([0], np.cumsum([len(a) for a in arrays])))
+    coords, offsets, removed = geometry.prepare_parts(
+        coords, offsets, closed=closed, clip=clip, tolerance=tolerance)
+    if stats is not None:
+        stats.add('removed_vertices', removed)
+        stats.add('vertices', len(coords))
+    return geometry.encode_geometry(coords, offsets, closed)
+
 def singles(f):
     g = f.get('geometry')
     if not g:
@@ -62,83 +88,118 @@ def pairwise(iterable):
     next(b, None)
     return zip(a, b)
 
-def layer(name, features):
-    """Make a vector_tile.Tile.Layer from GeoJSON features."""
-    pbl = vector_tile_pb2.tile.layer()
+def layer(name, features, explode=False, extent=4096, buffer=None,
+          simplify=None, stats=None):
+    """Make a vector_tile.Tile.Layer from GeoJSON features.
+
+    Multi-part geometries are encoded as one feature with several
+    MoveTo runs in its command stream. With explode=True they are split
+    into one feature per part instead, as singles() does.
+
+    Coordinates are in tile units from 0 to extent. When buffer is given,
+    geometries are clipped to the extent grown by buffer units on every
+    side and features left empty are dropped.
+
+    simplify is an optional Douglas-Peucker tolerance in tile units for
+    lines and polygons; repeated vertices are always removed.
+
+    stats is an optional stats.Stats collecting the time spent on
+    geometry, attributes and encoding, and counts of features, vertices,
+    dropped features, removed vertices and distinct keys and values.
+    """
+    pbl = vector_tile_pb2.Tile.Layer()
     pbl.name = name
     pbl.version = 1
+    pbl.extent = extent
+    clip = None
+    if buffer is not None:
+        clip = (-buffer, -buffer, extent + buffer, extent + buffer)
 
-    pb_keys = []
-    pb_vals = []
-    pb_features = []
+    # key -> index and (value field, value) -> index
+    pb_keys = {}
+    pb_vals = {}
 
-    for j, f in enumerate(
-            chain.from_iterable(singles(ob) for ob in features)):
-        pbf = vector_tile_pb2.tile.feature()
-        pbf.id = j
+    if explode:
+        features = chain.from_iterable(singles(ob) for ob in features)
 
+    for j, f in enumerate(features):
+        if stats is not None:
+            t = clock()
         # Pack up the feature geometry.
         g = f.get('geometry')
+        cmds = None
         if g:
             gtype = g['type']
             coords = g['coordinates']
-            if gtype == 'Point':
-                geometry = [(1<<3)+1] + [
-                    (n << 1) ^ (n >> 31) for n in map(int, coords)]
+            if gtype in ('Point', 'MultiPoint'):
+                points = np.asarray(coords, dtype=np.float64).reshape(-1, 2).astype(np.int64)
+                if clip is not None:
+                    points = points[
+                        (points[:,0] >= clip[0]) & (points[:,0] <= clip[2]) &
+                        (points[:,1] >= clip[1]) & (points[:,1] <= clip[3])]
+                cmds = geometry.encode_points(points)
+                if stats is not None:
+                    stats.add('vertices', len(points))
             elif gtype == 'LineString':
-                num = len(coords)
-                geometry = [0]*(4 + 2*(num-1))
-                geometry[0] = (1<<3)+1
-                geometry[1:3] = (
-                    (n << 1) ^ (n >> 31) for n in map(int, coords[0]))
-                geometry[3] = ((num-1)<<3)+2
-                for i, (prev, pair) in enumerate(pairwise(coords), 1):
-                    prev = map(int, prev)
-                    pair = map(int, pair)
-                    geometry[2*i+2:2*i+4] = (
-                        (n << 1) ^ (n >> 31) for n in (
-                            pair[0]-prev[0], pair[1]-prev[1]))
-                pbf.geometry.extend(geometry)
+                cmds = parts_geometry(
+                    [coords], clip=clip, tolerance=simplify, stats=stats)
             elif gtype == 'Polygon':
-                rings = []
-                for ring in coords:
-                    num = len(ring)
-                    geometry = [0]*(5 + 2*(num-1))
-                    geometry[0] = (1<<3)+1
-                    geometry[1:3] = (
-                        (n << 1) ^ (n >> 31) for n in map(int, ring[0]))
-                    geometry[3] = ((num-1)<<3)+2
-                    for i, (prev, pair) in enumerate(pairwise(ring), 1):
-                        prev = map(int, prev)
-                        pair = map(int, pair)
-                        geometry[2*i+2:2*i+4] = (
-                            (n << 1) ^ (n >> 31) for n in (
-                                pair[0]-prev[0], pair[1]-prev[1]))
-                    geometry[-1] = (1<<3)+7
-                    pbf.geometry.extend(geometry)
-
+                cmds = parts_geometry(
+                    coords, closed=True, clip=clip, tolerance=simplify,
+                    stats=stats)
+            elif gtype == 'MultiLineString':
+                cmds = parts_geometry(
+                    coords, clip=clip, tolerance=simplify, stats=stats)
+            elif gtype == 'MultiPolygon':
+                cmds = parts_geometry(
+                    [ring for polygon in coords for ring in polygon],
+                    closed=True, clip=clip, tolerance=simplify, stats=stats)
+            else:
+                raise ValueError("Unsupported geometry type: '%s'" % gtype)
+            if not len(cmds):
+                if stats is not None:
+                    stats.lap('geometry', t)
+                    stats.add('dropped_features')
+                continue
+        if stats is not None:
+            t = stats.lap('geometry', t)
+
+        pbf = pbl.features.add()
+        pbf.id = j
+        if g:
+            pbf.geometry.extend(cmds.tolist())
             pbf.type = geom_type_map[gtype]
+        if stats is not None:
+            t = stats.lap('encoding', t)
 
         # Pack up feature properties.
-        props = f.get('properties', {})
-        tags = [0]*(2*len(props))
-        for i, (k, v) in enumerate(props.items()):
-            if k not in pb_keys:
-                pb_keys.append(k)
-            if v not in pb_vals:
-                pb_vals.append(v)
-            tags[i*2:i*2+2] = pb_keys.index(k), pb_vals.index(v)
+        props = f.get('properties') or {}
+        tags = []
+        for k, v in props.items():
+            key_id = pb_keys.get(k)
+            if key_id is None:
+                key_id = pb_keys[k] = len(pb_keys)
+                pbl.keys.append(k)
+            field = value_type_map[type(v)]
+            val_id = pb_vals.get((field, v))
+            if val_id is None:
+                val_id = pb_vals[(field, v)] = len(pb_vals)
+                setattr(pbl.values.add(), field, v)
+            tags.append(key_id)
+            tags.append(val_id)
         pbf.tags.extend(tags)
-        pb_features.append(pbf)
+        if stats is not None:
+            stats.lap('attributes', t)
+            stats.add('features')
 
-    # Finish up the layer.
-    pbl.keys.extend(map(str, pb_keys))
-    pbl.values.extend(map(value, filter(None, pb_vals)))
+    if stats is not None:
+        stats.add('keys', len(pb_keys))
+        stats.add('values', len(pb_vals))
 
     return pbl
 
 def tile(layers):
-    pbt = vector_tile_pb2.tile()
+    pbt = vector_tile_pb2.Tile()
     pbt.layers.extend(list(layers))
     return pbt
 
@@ -0,0 +1,195 @@
+"""
+Single-file, memory-mapped archive of a tile pyramid.
+
+Layout, all integers little-endian:
+
+    header   magic b'VTA1', uint32 tile count
+    index    one entry per tile, sorted by key:
+             uint64 key, uint64 offset, uint32 length, uint32 x, uint32 y
+    data     the tile blobs, in index order
+
+A key is the zoom in the top byte and the tile's position along the
+Hilbert curve of its zoom level below, so tiles close on the map are
+close in the file. Lookups binary search the index in place through
+mmap and return memoryview slices of the data without copying (on
+Python 2, whose mmap does not support memoryview, copies of them).
+Identical blobs are stored once.
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from .renderer import VectorTile
+
+MAGIC = b'VTA1'
+HEADER = struct.Struct('<4sI')
+ENTRY = struct.Struct('<QQIII')
+KEY = struct.Struct('<Q')
+
+
+def hilbert_index(zoom, x, y):
+    "Position of tile x,y along the Hilbert curve covering zoom"
+    n = 1 << zoom
+    d = 0
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        d += s * s * ((3 * rx) ^ ry)
+        if ry == 0:
+            if rx == 1:
+                x = n - 1 - x
+                y = n - 1 - y
+            x, y = y, x
+        s >>= 1
+    return d
+
+
+def tile_key(zoom, x, y):
+    return (zoom << 56) | hilbert_index(zoom, x, y)
+
+
+class ArchiveWriter(object):
+    """
+    Write tiles to an archive at path.
+
+    Blobs are spooled to a temporary file as they arrive and the archive
+    is assembled in key order by close().
+    """
+    def __init__(self, path):
+        self.path = path
+        self.spool = tempfile.TemporaryFile()
+        self.entries = {}
+        self.blobs = {}
+        self.size = 0
+
+    def add(self, z, x, y, data):
+        data = bytes(data)
+        digest = hashlib.md5(data).digest()
+        span = self.blobs.get(digest)
+        if span is None:
+            span = self.blobs[digest] = (self.size, len(data))
+            self.spool.write(data)
+            self.size += len(data)
+        self.entries[tile_key(z, x, y)] = (x, y, span)
+
+    def add_tiles(self, tiles):
+        "Add an iterable of (z, x, y, bytes), e.g. from pyramid.build_pyramid"
+        for z, x, y, data in tiles:
+            self.add(z, x, y, data)
+
+    def close(self):
+        keys = sorted(self.entries)
+        data_start = HEADER.size + ENTRY.size * len(keys)
+        offsets = {}
+        order = []
+        for key in keys:
+            span = self.entries[key][2]
+            if span not in offsets:
+                offsets[span] = data_start
+                data_start += span[1]
+                order.append(span)
+        with open(self.path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(keys)))
+            for key in keys:
+                x, y, span = self.entries[key]
+                f.write(ENTRY.pack(key, offsets[span], span[1], x, y))
+            for start, length in order:
+                self.spool.seek(start)
+                f.write(self.spool.read(length))
+        self.spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+        else:
+            self.spool.close()
+
+
+def write_archive(path, tiles):
+    "Write an iterable of (z, x, y, bytes) to a new archive at path"
+    with ArchiveWriter(path) as writer:
+        writer.add_tiles(tiles)
+
+
+class Archive(object):
+    """
+    Read-only, memory-mapped view of an archive.
+
+    Tiles are returned as memoryview slices of the mapping; release them
+    before calling close(). On Python 2 they are byte strings instead.
+    """
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        if os.fstat(self.file.fileno()).st_size < HEADER.size:
+            raise ValueError("not a tile archive: %s" % path)
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if sys.version_info.major < 3:
+            self.buf = self.mm
+        else:
+            self.buf = memoryview(self.mm)
+        magic, self.count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("not a tile archive: %s" % path)
+
+    def close(self):
+        if self.buf is not self.mm:
+            self.buf.release()
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _find(self, key):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = KEY.unpack_from(self.mm, HEADER.size + mid * ENTRY.size)[0]
+            if k < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.count:
+            entry = ENTRY.unpack_from(self.mm, HEADER.size + lo * ENTRY.size)
+            if entry[0] == key:
+                return entry
+        return None
+
+    def get_tile(self, z, x, y):
+        "Return tile z/x/y as a memoryview, or None"
+        entry = self._find(tile_key(z, x, y))
+        if entry is None:
+            return None
+        offset, length = entry[1], entry[2]
+        return self.buf[offset:offset + length]
+
+    def get_request(self, req):
+        return self.get_tile(req.zoom, req.x, req.y)
+
+    def get_vector_tile(self, req, **kwargs):
+        "Load the tile of req as a VectorTile, or None if it is missing"
+        data = self.get_request(req)
+        if data is None:
+            return None
+        return VectorTile.from_message(req, data, **kwargs)
+
+    def __iter__(self):
+        "Generate the (z, x, y) of every tile in key order"
+        for i in range(self.count):
+            key, _, _, x, y = ENTRY.unpack_from(self.mm, HEADER.size + i * ENTRY.size)
+            yield key >> 56, x, y
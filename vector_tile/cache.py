@@ -0,0 +1,157 @@
+"""
+Bounded cache of decoded tiles.
+
+Tools that inspect tiles tend to decode the same popular tiles again and
+again. TileCache keys entries by a hash of the tile bytes, so a repeat
+request for a tile it has seen skips decompression and protobuf parsing
+entirely. It holds these kinds of entry:
+
+- the parsed vector_tile_pb2.Tile, shared by all requests
+- the VectorTile wrapper for one Request
+- to_geojson() output for one Request and (layer, lonlat, layer_names)
+- values callers store with put(), such as encoded responses
+
+Cached objects are shared between callers and must not be modified.
+
+Entry sizes are estimates derived from the decompressed tile size, since
+measuring Python object graphs is too slow to do per entry. The factors
+below were measured with the pure-python protobuf backend. The C++
+backend parses into much less memory, so there they overestimate. The
+Tile referenced by a VectorTile entry is charged to both entries, which
+also errs on the high side.
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from .compression import decompress
+from .renderer import VectorTile, vector_tile_pb2
+
+# approximate bytes of memory per byte of serialized tile
+PARSED_OVERHEAD = 50
+WRAPPER_OVERHEAD = 4
+GEOJSON_OVERHEAD = 30
+
+DEFAULT_MAXBYTES = 256 * 1024 * 1024
+
+
+def content_hash(data):
+    "Hash identifying tile bytes in cache keys"
+    return hashlib.sha1(data).digest()
+
+
+class TileCache(object):
+    """
+    LRU cache of parsed tiles, VectorTiles and GeoJSON holding at most
+    about maxbytes. Safe to share between threads.
+    """
+    def __init__(self, maxbytes=DEFAULT_MAXBYTES):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (value, size)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stats(self):
+        "Counters as a dict; hits and misses count every entry lookup"
+        return {'entries': len(self.entries), 'nbytes': self.nbytes,
+                'maxbytes': self.maxbytes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def get(self, key):
+        """
+        Return the value stored under key by put(), or None. For callers
+        caching their own products of a tile, such as encoded responses.
+        """
+        return self._get(('user', key))
+
+    def put(self, key, value, size):
+        "Store value under key, charging it size bytes"
+        self._put(('user', key), value, size)
+
+    def _get(self, key):
+        with self.lock:
+            try:
+                entry = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            self.hits += 1
+            return entry[0]
+
+    def _put(self, key, value, size):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            if size > self.maxbytes:
+                return
+            self.entries[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.maxbytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def _parse(self, data, digest):
+        key = ('tile', digest)
+        entry = self._get(key)
+        if entry is None:
+            raw = decompress(data)
+            tile = vector_tile_pb2.Tile()
+            tile.ParseFromString(raw)
+            entry = (tile, len(raw))
+            self._put(key, entry, len(raw) * PARSED_OVERHEAD)
+        return entry
+
+    def tile(self, data):
+        "Return data, possibly compressed, parsed into a Tile"
+        return self._parse(data, content_hash(data))[0]
+
+    def _vector_tile(self, req, data, digest):
+        key = ('vtile', digest, req.x, req.y, req.zoom, req.size)
+        entry = self._get(key)
+        if entry is None:
+            tile, raw_size = self._parse(data, digest)
+            entry = (VectorTile(req, tile), raw_size)
+            self._put(key, entry, raw_size * (PARSED_OVERHEAD + WRAPPER_OVERHEAD))
+        return entry
+
+    def vector_tile(self, req, data):
+        "Return a VectorTile for data at req, see VectorTile.from_message"
+        return self._vector_tile(req, data, content_hash(data))[0]
+
+    def geojson(self, req, data, layer=None, lonlat=False, layer_names=False):
+        """
+        Return VectorTile.to_geojson() of data at req. layer is a layer
+        name rather than a Layer message; unknown names give no features.
+        """
+        digest = content_hash(data)
+        key = ('geojson', digest, req.x, req.y, req.zoom, req.size,
+               layer, lonlat, layer_names)
+        jobj = self._get(key)
+        if jobj is None:
+            vtile, raw_size = self._vector_tile(req, data, digest)
+            if layer is None:
+                jobj = vtile.to_geojson(lonlat=lonlat, layer_names=layer_names)
+            else:
+                jobj = {'type': 'FeatureCollection', 'features': []}
+                for pbl in vtile.tile.layers:
+                    if pbl.name == layer:
+                        jobj = vtile.to_geojson(pbl, lonlat=lonlat, layer_names=layer_names)
+                        break
+            self._put(key, jobj, raw_size * GEOJSON_OVERHEAD)
+        return jobj
@@ -0,0 +1,103 @@
+"""
+Compression of serialized tiles.
+
+Tiles are commonly stored and served gzip compressed. compress() and
+decompress() handle gzip, zlib and, when the zstandard package is
+installed, zstd. decompress() detects the format from the leading magic
+bytes, so callers need not know how a tile was stored.
+
+zstd contexts are set up once per level and per thread and reused
+across calls. gzip and zlib streams are cheap to create and are made
+fresh for each call.
+"""
+
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP = 'gzip'
+ZLIB = 'zlib'
+ZSTD = 'zstd'
+
+# zlib window bits selecting the container format
+_wbits = {GZIP: 16 + zlib.MAX_WBITS, ZLIB: zlib.MAX_WBITS}
+# gzip or zlib header, detected automatically
+_AUTO_WBITS = 32 + zlib.MAX_WBITS
+
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+_local = threading.local()
+
+
+def _cache():
+    try:
+        return _local.cache
+    except AttributeError:
+        _local.cache = {}
+        return _local.cache
+
+
+def _bytes(data):
+    # bytes() of a Python 2 memoryview is its repr
+    return data.tobytes() if isinstance(data, memoryview) else bytes(data)
+
+
+def detect(data):
+    "Return the compression of data: 'gzip', 'zlib', 'zstd' or None"
+    head = _bytes(data[:4])
+    if head[:2] == b'\x1f\x8b':
+        return GZIP
+    if head == _ZSTD_MAGIC:
+        return ZSTD
+    if len(head) >= 2 and (ord(head[0:1]) & 0x0f) == 8 and \
+            ((ord(head[0:1]) << 8) | ord(head[1:2])) % 31 == 0:
+        return ZLIB
+    return None
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise RuntimeError("zstd compression requires the zstandard package")
+
+
+def compress(data, compression=GZIP, level=None):
+    """
+    Compress data with compression, one of 'gzip', 'zlib', 'zstd' or
+    None for no compression. level defaults to the library default.
+    """
+    if compression is None:
+        return data
+    if compression in _wbits:
+        c = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+            zlib.DEFLATED, _wbits[compression])
+        return c.compress(data) + c.flush()
+    elif compression == ZSTD:
+        _require_zstd()
+        cache = _cache()
+        key = (compression, level)
+        c = cache.get(key)
+        if c is None:
+            c = cache[key] = zstandard.ZstdCompressor(
+                level=3 if level is None else level)
+        return c.compress(data)
+    raise ValueError("Unknown compression: '%s'" % compression)
+
+
+def decompress(data):
+    "Decompress data in whichever supported format it is; return as is otherwise"
+    compression = detect(data)
+    if compression is None:
+        return data
+    if compression == ZSTD:
+        _require_zstd()
+        cache = _cache()
+        d = cache.get(ZSTD)
+        if d is None:
+            d = cache[ZSTD] = zstandard.ZstdDecompressor()
+        return d.decompress(_bytes(data))
+    return zlib.decompress(data, _AUTO_WBITS)
@@ -0,0 +1,473 @@
+"""
+Array based encoding and decoding of vector tile geometry command streams.
+
+A feature's geometry is a sequence of command integers, each followed by
+its zigzag and delta encoded parameters. The functions here convert
+between that representation and numpy arrays of integer tile coordinates
+split into parts by an offsets array.
+"""
+
+import numpy as np
+
+CMD_BITS = 3
+SEG_MOVETO = 1
+SEG_LINETO = 2
+SEG_CLOSE = 7
+
+
+def zigzag_decode(a):
+    "Decode an array of zigzag encoded integers"
+    return (a >> 1) ^ -(a & 1)
+
+
+def zigzag_encode(a):
+    "Zigzag encode an array of signed 32 bit integers"
+    return (a << 1) ^ (a >> 31)
+
+
+def decode_geometry(geometry):
+    """
+    Decode a command stream into absolute tile coordinates.
+
+    Returns (coords, offsets, closed) where coords is an (n, 2) int64
+    array of vertices, part i spans coords[offsets[i]:offsets[i+1]] and
+    closed[i] is True when part i was terminated by a ClosePath. Every
+    MoveTo vertex starts a new part, so a multipoint yields one part per
+    point.
+    """
+    g = list(geometry)
+    n = len(g)
+    headers = []
+    starts = []
+    closes = []
+    vertices = 0
+    i = 0
+    while i < n:
+        cmd = g[i] & ((1 << CMD_BITS) - 1)
+        count = g[i] >> CMD_BITS
+        headers.append(i)
+        i += 1
+        if cmd == SEG_MOVETO:
+            starts.extend(range(vertices, vertices + count))
+            vertices += count
+            i += 2 * count
+        elif cmd == SEG_LINETO:
+            vertices += count
+            i += 2 * count
+        elif cmd == SEG_CLOSE:
+            if starts:
+                closes.append(len(starts) - 1)
+        else:
+            raise ValueError("unknown command type: %d" % cmd)
+    if i > n:
+        raise ValueError("truncated geometry command stream")
+
+    params = np.asarray(g, dtype=np.int64)
+    mask = np.ones(n, dtype=bool)
+    mask[headers] = False
+    params = zigzag_decode(params[mask]).reshape(-1, 2)
+    coords = np.cumsum(params, axis=0)
+
+    offsets = np.empty(len(starts) + 1, dtype=np.int64)
+    offsets[:-1] = starts
+    offsets[-1] = vertices
+    closed = np.zeros(len(starts), dtype=bool)
+    closed[closes] = True
+    return coords, offsets, closed
+
+
+def decode_parts(geometry):
+    """
+    Pure Python decode_geometry for short command streams, where the
+    fixed cost of the array operations outweighs the work per vertex.
+
+    Returns (parts, closed): a list of [x, y] tile coordinate lists, one
+    per part, with closed parts repeating their first vertex as
+    close_rings does, and a list flagging the closed parts.
+    """
+    parts = []
+    closed = []
+    part = None
+    x = y = 0
+    n = len(geometry)
+    i = 0
+    while i < n:
+        cmd = geometry[i] & ((1 << CMD_BITS) - 1)
+        count = geometry[i] >> CMD_BITS
+        i += 1
+        if cmd == SEG_MOVETO or cmd == SEG_LINETO:
+            if i + 2 * count > n:
+                raise ValueError("truncated geometry command stream")
+            for _ in range(count):
+                dx = geometry[i]
+                dy = geometry[i+1]
+                i += 2
+                x += (dx >> 1) ^ -(dx & 1)
+                y += (dy >> 1) ^ -(dy & 1)
+                if cmd == SEG_MOVETO:
+                    part = [[x, y]]
+                    parts.append(part)
+                    closed.append(False)
+                elif part is not None:
+                    part.append([x, y])
+        elif cmd == SEG_CLOSE:
+            if parts:
+                closed[-1] = True
+        else:
+            raise ValueError("unknown command type: %d" % cmd)
+    for part, c in zip(parts, closed):
+        if c:
+            part.append(list(part[0]))
+    return parts, closed
+
+
+def part_area(part):
+    "Signed shoelace area of one part of [x, y] pairs, as ring_areas"
+    area = 0
+    for i in range(len(part)):
+        x0, y0 = part[i - 1]
+        x1, y1 = part[i]
+        area += x0 * y1 - x1 * y0
+    return area / 2.0
+
+
+def close_rings(coords, offsets, closed):
+    """
+    Repeat the first vertex at the end of every closed part.
+
+    Returns new (coords, offsets) arrays, the form GeoJSON expects for
+    polygon rings.
+    """
+    if not closed.any():
+        return coords, offsets
+    ends = offsets[1:][closed]
+    coords = np.insert(coords, ends, coords[offsets[:-1][closed]], axis=0)
+    offsets = offsets + np.concatenate(([0], np.cumsum(closed)))
+    return coords, offsets
+
+
+def strip_closing(coords, offsets, closed):
+    """
+    Drop the repeated first vertex from the end of every closed part.
+
+    The inverse of close_rings: returns new (coords, offsets) arrays with
+    the GeoJSON closing vertex removed wherever it is present, since
+    ClosePath already implies it.
+    """
+    starts = offsets[:-1]
+    ends = offsets[1:]
+    repeat = closed & (ends - starts > 1)
+    repeat[repeat] = (coords[ends[repeat] - 1] == coords[starts[repeat]]).all(axis=1)
+    if not repeat.any():
+        return coords, offsets
+    coords = np.delete(coords, ends[repeat] - 1, axis=0)
+    offsets = offsets - np.concatenate(([0], np.cumsum(repeat)))
+    return coords, offsets
+
+
+def encode_geometry(coords, offsets, closed=False):
+    """
+    Encode parts of integer tile coordinates as a command stream.
+
+    coords is an (n, 2) integer array and part i spans
+    coords[offsets[i]:offsets[i+1]]. Each part becomes a MoveTo followed
+    by a LineTo over its remaining vertices, plus a ClosePath when closed
+    (a bool, or a bool array with one entry per part) is set. Returns a
+    uint32 array of command integers with delta and zigzag encoded
+    parameters.
+    """
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    counts = np.diff(offsets)
+    closed = np.broadcast_to(np.asarray(closed, dtype=bool), counts.shape)
+    keep = counts > 0
+    if not keep.all():
+        counts = counts[keep]
+        closed = closed[keep]
+    if not len(counts):
+        return np.empty(0, dtype=np.uint32)
+
+    # deltas run across part boundaries, the cursor is never reset
+    params = zigzag_encode(np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)))
+
+    # MoveTo and its parameters, LineTo and its parameters, ClosePath
+    sizes = 3 + np.where(counts > 1, 1 + 2 * (counts - 1), 0) + closed
+    part_starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    out = np.empty(int(sizes.sum()), dtype=np.uint32)
+
+    out[part_starts] = (1 << CMD_BITS) | SEG_MOVETO
+    lines = counts > 1
+    out[part_starts[lines] + 3] = ((counts[lines] - 1) << CMD_BITS) | SEG_LINETO
+    out[(part_starts + sizes - 1)[closed]] = (1 << CMD_BITS) | SEG_CLOSE
+
+    local = np.arange(len(coords)) - np.repeat(offsets[:-1][keep], counts)
+    pos = np.repeat(part_starts, counts) + 1 + 2 * local + (local > 0)
+    out[pos] = params[:, 0]
+    out[pos + 1] = params[:, 1]
+    return out
+
+
+def encode_points(coords):
+    """
+    Encode an (n, 2) integer array of points as a single MoveTo with n
+    parameter pairs, the command stream of a multipoint
+    """
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 2)
+    if not len(coords):
+        return np.empty(0, dtype=np.uint32)
+    params = zigzag_encode(np.diff(coords, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)))
+    out = np.empty(1 + 2 * len(coords), dtype=np.uint32)
+    out[0] = (len(coords) << CMD_BITS) | SEG_MOVETO
+    out[1:] = params.ravel()
+    return out
+
+
+def ring_areas(coords, offsets):
+    """
+    Return the signed shoelace area of every part, treating each as a
+    closed ring. The sign gives the winding order.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    counts = np.diff(offsets)
+    keep = counts > 0
+    areas = np.zeros(len(counts))
+    if not keep.any():
+        return areas
+    nxt = np.arange(1, len(coords) + 1)
+    nxt[offsets[1:][keep] - 1] = offsets[:-1][keep]
+    x = coords[:, 0]
+    y = coords[:, 1]
+    cross = x * y[nxt] - x[nxt] * y
+    areas[keep] = np.add.reduceat(cross, offsets[:-1][keep]) / 2.0
+    return areas
+
+
+def clip_lines(coords, offsets, bbox):
+    """
+    Clip line parts to bbox, given as (minx, miny, maxx, maxy).
+
+    Every segment is clipped at once with the Liang-Barsky parametric
+    test, which keeps exactly what Cohen-Sutherland keeps. Runs of kept
+    segments are stitched back into parts, so a line that leaves and
+    re-enters the box becomes several parts. Returns new (coords,
+    offsets) arrays with intersections rounded to integers.
+    """
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    # segment i runs from vertex i to vertex i+1 within one part
+    seg = np.ones(len(coords), dtype=bool)
+    seg[offsets[1:] - 1] = False
+    seg = np.flatnonzero(seg[:len(coords) - 1]) if len(coords) > 1 else np.empty(0, dtype=np.int64)
+    part = np.searchsorted(offsets, seg, side='right') - 1
+
+    p0 = coords[seg].astype(np.float64)
+    d = coords[seg + 1] - coords[seg]
+    t0 = np.zeros(len(seg))
+    t1 = np.ones(len(seg))
+    keep = np.ones(len(seg), dtype=bool)
+    minx, miny, maxx, maxy = bbox
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for p, q in ((-d[:, 0], p0[:, 0] - minx), (d[:, 0], maxx - p0[:, 0]),
+                     (-d[:, 1], p0[:, 1] - miny), (d[:, 1], maxy - p0[:, 1])):
+            r = q / p
+            keep &= ~((p == 0) & (q < 0))
+            entering = p < 0
+            leaving = p > 0
+            t0 = np.where(entering, np.maximum(t0, r), t0)
+            t1 = np.where(leaving, np.minimum(t1, r), t1)
+    keep &= t0 <= t1
+    seg = seg[keep]
+    part = part[keep]
+    t0 = t0[keep]
+    t1 = t1[keep]
+    d = d[keep]
+    start = np.rint(p0[keep] + t0[:, None] * d).astype(np.int64)
+    end = np.rint(p0[keep] + t1[:, None] * d).astype(np.int64)
+
+    # a kept segment starts a new part unless it directly continues the
+    # previous kept segment
+    new = np.ones(len(seg), dtype=bool)
+    new[1:] = ((seg[1:] != seg[:-1] + 1) | (part[1:] != part[:-1]) |
+               (t0[1:] > 0) | (t1[:-1] < 1))
+    counts = 1 + new
+    pos = np.cumsum(counts) - counts
+    out = np.empty((int(counts.sum()), 2), dtype=np.int64)
+    out[pos[new]] = start[new]
+    out[pos + new] = end
+    out_offsets = np.concatenate((pos[new], [len(out)])).astype(np.int64)
+    return out, out_offsets
+
+
+def _clip_ring_edge(ring, axis, value, keep_greater):
+    "One Sutherland-Hodgman pass of a ring against a half plane"
+    if keep_greater:
+        inside = ring[:, axis] >= value
+    else:
+        inside = ring[:, axis] <= value
+    prev = np.roll(ring, 1, axis=0)
+    prev_inside = np.roll(inside, 1)
+    cross = inside != prev_inside
+    counts = cross.astype(np.int64) + inside
+    pos = np.cumsum(counts) - counts
+    out = np.empty((int(counts.sum()), 2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (value - prev[:, axis]) / (ring[:, axis] - prev[:, axis])
+        inter = prev + t[:, None] * (ring - prev)
+    inter[:, axis] = value
+    out[pos[cross]] = inter[cross]
+    out[(pos + cross)[inside]] = ring[inside]
+    return out
+
+
+def clip_polygons(coords, offsets, bbox):
+    """
+    Clip polygon rings to bbox, given as (minx, miny, maxx, maxy).
+
+    Each ring, without its closing vertex, goes through four vectorized
+    Sutherland-Hodgman passes, one per box edge. Rings left with fewer
+    than three vertices are dropped. Returns new (coords, offsets)
+    arrays with intersections rounded to integers.
+    """
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 2)
+    minx, miny, maxx, maxy = bbox
+    rings = []
+    for i in range(len(offsets) - 1):
+        ring = coords[offsets[i]:offsets[i+1]]
+        if not len(ring):
+            continue
+        if (ring[:, 0].min() >= minx and ring[:, 0].max() <= maxx and
+                ring[:, 1].min() >= miny and ring[:, 1].max() <= maxy):
+            rings.append(ring)
+            continue
+        ring = ring.astype(np.float64)
+        for axis, value, keep_greater in ((0, minx, True), (0, maxx, False),
+                                          (1, miny, True), (1, maxy, False)):
+            ring = _clip_ring_edge(ring, axis, value, keep_greater)
+            if not len(ring):
+                break
+        if len(ring) >= 3:
+            rings.append(np.rint(ring).astype(np.int64))
+    if not rings:
+        return np.empty((0, 2), dtype=np.int64), np.zeros(1, dtype=np.int64)
+    out_offsets = np.concatenate(([0], np.cumsum([len(r) for r in rings])))
+    return np.concatenate(rings), out_offsets
+
+
+def remove_repeated(coords, offsets):
+    """
+    Drop vertices equal to the vertex before them in the same part.
+
+    Quantization to the tile grid makes neighbouring vertices collapse
+    onto the same cell, and clipping can repeat box corners. Returns new
+    (coords, offsets) arrays.
+    """
+    dup = np.zeros(len(coords), dtype=bool)
+    if len(coords) > 1:
+        dup[1:] = (coords[1:] == coords[:-1]).all(axis=1)
+        dup[offsets[:-1][offsets[:-1] < len(coords)]] = False
+    if not dup.any():
+        return coords, offsets
+    removed = np.concatenate(([0], np.cumsum(dup)))
+    return coords[~dup], offsets - removed[offsets]
+
+
+def drop_short_parts(coords, offsets, min_count):
+    "Drop parts with fewer than min_count vertices"
+    counts = np.diff(offsets)
+    short = counts < min_count
+    if not short.any():
+        return coords, offsets
+    keep = np.repeat(~short, counts)
+    counts = counts[~short]
+    return coords[keep], np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+
+def _douglas_peucker(points, tolerance):
+    "Return a bool mask of the vertices of points to keep"
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    tolerance2 = float(tolerance) ** 2
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b <= a + 1:
+            continue
+        seg = points[b] - points[a]
+        rel = points[a+1:b] - points[a]
+        length2 = float(seg[0] * seg[0] + seg[1] * seg[1])
+        if length2 == 0:
+            d2 = (rel * rel).sum(axis=1)
+        else:
+            cross = rel[:, 0] * seg[1] - rel[:, 1] * seg[0]
+            d2 = cross * cross / length2
+        i = int(np.argmax(d2))
+        if d2[i] > tolerance2:
+            keep[a + 1 + i] = True
+            stack.append((a, a + 1 + i))
+            stack.append((a + 1 + i, b))
+    return keep
+
+
+def simplify(coords, offsets, tolerance, closed=False):
+    """
+    Douglas-Peucker simplification of every part.
+
+    tolerance is in the units of coords. Closed parts are simplified as
+    rings, with their first vertex as the fixed end point. Returns new
+    (coords, offsets) arrays.
+    """
+    coords = np.asarray(coords).reshape(-1, 2)
+    keep = np.ones(len(coords), dtype=bool)
+    points = coords.astype(np.float64)
+    for i in range(len(offsets) - 1):
+        start, end = offsets[i], offsets[i+1]
+        if end - start < 3:
+            continue
+        part = points[start:end]
+        if closed:
+            part = np.concatenate((part, part[:1]))
+            keep[start:end] = _douglas_peucker(part, tolerance)[:-1]
+        else:
+            keep[start:end] = _douglas_peucker(part, tolerance)
+    if keep.all():
+        return coords, offsets
+    removed = np.concatenate(([0], np.cumsum(~keep)))
+    return coords[keep], offsets - removed[offsets]
+
+
+def prepare_parts(coords, offsets, closed=False, clip=None, tolerance=None):
+    """
+    Run the geometry stages between quantization and encoding.
+
+    coords are integer tile coordinates, closed marks the parts as
+    polygon rings. The GeoJSON closing vertex is stripped, parts are
+    simplified when tolerance is given and clipped to the clip box when
+    given, repeated vertices are removed and parts too short to encode
+    are dropped. Returns (coords, offsets, removed) where removed counts
+    the vertices dropped by simplification and repeated point removal.
+    """
+    coords = np.asarray(coords, dtype=np.int64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    parts = len(offsets) - 1
+    if closed:
+        coords, offsets = strip_closing(coords, offsets, np.ones(parts, dtype=bool))
+    removed = 0
+    count = len(coords)
+    coords, offsets = remove_repeated(coords, offsets)
+    if tolerance:
+        coords, offsets = simplify(coords, offsets, tolerance, closed=closed)
+    removed += count - len(coords)
+    if clip is not None:
+        if closed:
+            coords, offsets = clip_polygons(coords, offsets, clip)
+        else:
+            coords, offsets = clip_lines(coords, offsets, clip)
+        count = len(coords)
+        coords, offsets = remove_repeated(coords, offsets)
+        if closed:
+            coords, offsets = strip_closing(
+                coords, offsets, np.ones(len(offsets) - 1, dtype=bool))
+        removed += count - len(coords)
+    coords, offsets = drop_short_parts(coords, offsets, 3 if closed else 2)
+    return coords, offsets, removed
@@ -0,0 +1,176 @@
+"""
+Store and fetch vector tiles in an MBTiles file.
+
+MBTiles is a SQLite database of tiles addressed by zoom, column and TMS
+row. This module uses the deduplicating layout: a map table points each
+tile address at a tile_id in an images table, so identical tiles, such
+as empty ocean, are stored once. The standard tiles view is created on
+top for other readers.
+
+Tiles are addressed here by the XYZ scheme of renderer.Request; the TMS
+row flip happens internally.
+"""
+
+import hashlib
+import os
+import sqlite3
+import sys
+from itertools import islice
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+from .renderer import VectorTile
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT, UNIQUE (name));
+CREATE TABLE IF NOT EXISTS map (
+    zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT,
+    UNIQUE (zoom_level, tile_column, tile_row));
+CREATE TABLE IF NOT EXISTS images (tile_id TEXT PRIMARY KEY, tile_data BLOB);
+CREATE VIEW IF NOT EXISTS tiles AS
+    SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+           map.tile_row AS tile_row, images.tile_data AS tile_data
+    FROM map JOIN images ON images.tile_id = map.tile_id;
+"""
+
+GET_TILE = ("SELECT tile_data FROM tiles "
+            "WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?")
+GET_RANGE = ("SELECT tile_column, tile_row, tile_data FROM tiles "
+             "WHERE zoom_level = ? AND tile_column BETWEEN ? AND ? "
+             "AND tile_row BETWEEN ? AND ?")
+PUT_IMAGE = "INSERT OR IGNORE INTO images (tile_id, tile_data) VALUES (?, ?)"
+PUT_MAP = ("INSERT OR REPLACE INTO map "
+           "(zoom_level, tile_column, tile_row, tile_id) VALUES (?, ?, ?, ?)")
+
+# sqlite3.connect takes uri=True from Python 3.4
+URI_CONNECT = sys.version_info >= (3, 4)
+
+
+def flip_y(y, zoom):
+    "Convert between XYZ and TMS tile rows"
+    return (1 << zoom) - 1 - y
+
+
+def connect_readonly(path):
+    """
+    Open the SQLite database at path read-only, raising
+    sqlite3.OperationalError rather than creating it when it is missing.
+    Without URI filenames the connection is opened normally and made
+    read-only by the query_only pragma.
+    """
+    if URI_CONNECT:
+        return sqlite3.connect('file:%s?mode=ro' % quote(path),
+                               uri=True, check_same_thread=False)
+    if not os.path.isfile(path):
+        raise sqlite3.OperationalError("unable to open database file")
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA query_only=1")
+    return conn
+
+
+class MBTiles(object):
+    """
+    An MBTiles file opened for reading (mode 'r') or writing (mode 'w',
+    which creates the schema if needed and keeps existing tiles).
+
+    Readers open the file read-only, so a missing file raises
+    sqlite3.OperationalError instead of being created.
+
+    Writers use WAL journaling and commit in large batches.
+    """
+    def __init__(self, path, mode='r'):
+        if mode not in ('r', 'w'):
+            raise ValueError("mode must be 'r' or 'w'")
+        self.path = path
+        self.mode = mode
+        if mode == 'r':
+            self.conn = connect_readonly(path)
+        else:
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+        if mode == 'w':
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+            self.conn.execute(
+                "INSERT OR IGNORE INTO metadata (name, value) VALUES ('format', 'pbf')")
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def metadata(self):
+        return dict(self.conn.execute("SELECT name, value FROM metadata"))
+
+    def set_metadata(self, values):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+                [(k, str(v)) for k, v in values.items()])
+
+    def write_tiles(self, tiles, batch_size=10000):
+        """
+        Write an iterable of (z, x, y, bytes), such as the output of
+        pyramid.build_pyramid, committing every batch_size tiles. Returns
+        the number of tiles written.
+        """
+        count = 0
+        tiles = iter(tiles)
+        while True:
+            batch = list(islice(tiles, batch_size))
+            if not batch:
+                return count
+            images = {}
+            rows = []
+            for z, x, y, data in batch:
+                data = bytes(data)
+                tile_id = hashlib.md5(data).hexdigest()
+                images[tile_id] = data
+                rows.append((z, x, flip_y(y, z), tile_id))
+            with self.conn:
+                self.conn.executemany(PUT_IMAGE, [
+                    (tile_id, sqlite3.Binary(data))
+                    for tile_id, data in images.items()])
+                self.conn.executemany(PUT_MAP, rows)
+            count += len(batch)
+
+    def put_tile(self, z, x, y, data):
+        self.write_tiles([(z, x, y, data)])
+
+    def write_vector_tile(self, vtile, compression='gzip', level=None):
+        "Store vtile at the address of its request"
+        req = vtile.request
+        self.put_tile(req.zoom, req.x, req.y,
+                      vtile.to_message(compression=compression, level=level))
+
+    def get_tile(self, z, x, y):
+        "Return the stored bytes of tile z/x/y, or None"
+        row = self.conn.execute(GET_TILE, (z, x, flip_y(y, z))).fetchone()
+        return bytes(row[0]) if row else None
+
+    def get_request(self, req):
+        return self.get_tile(req.zoom, req.x, req.y)
+
+    def get_vector_tile(self, req, **kwargs):
+        "Load the tile of req as a VectorTile, or None if it is missing"
+        data = self.get_request(req)
+        if data is None:
+            return None
+        return VectorTile.from_message(req, data, **kwargs)
+
+    def get_tiles(self, zoom, minx, miny, maxx, maxy):
+        """
+        Generate (z, x, y, bytes) for the stored tiles of zoom whose XYZ
+        address lies in the inclusive range, with one query
+        """
+        rows = self.conn.execute(GET_RANGE, (
+            zoom, minx, maxx, flip_y(maxy, zoom), flip_y(miny, zoom)))
+        for x, row, data in rows:
+            yield zoom, x, flip_y(row, zoom), bytes(data)
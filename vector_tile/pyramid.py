@@ -0,0 +1,86 @@
+"""
+Build a pyramid of vector tiles from a source of features.
+
+Features are GeoJSON-like mappings with mercator coordinates. For every
+zoom level they are bucketed by the tiles they touch, including those
+whose buffer they reach into, and each tile is encoded in a worker
+process that receives only its own bucket.
+"""
+
+import multiprocessing
+
+from .renderer import Request, VectorTile
+from .tilecover import bucket_features
+
+
+def render_tile(task):
+    """
+    Encode one tile.
+
+    task is a (z, x, y, layer_name, features, path_multiplier, buffer)
+    tuple. Returns (z, x, y, bytes), or None when no feature ended up
+    in the tile.
+    """
+    z, x, y, layer_name, features, path_multiplier, buffer = task
+    vtile = VectorTile(Request(x, y, z), path_multiplier=path_multiplier,
+                       buffer=buffer)
+    layer = vtile.add_layer(layer_name)
+    xs = []
+    ys = []
+    props = []
+    for f in features:
+        g = f['geometry']
+        if g['type'] == 'Point':
+            xs.append(g['coordinates'][0])
+            ys.append(g['coordinates'][1])
+            props.append(f.get('properties') or {})
+        else:
+            vtile.add_feature(layer, g, f.get('properties') or {})
+    if xs:
+        vtile.add_points(layer, xs, ys, props)
+    if not len(layer.features):
+        return None
+    return z, x, y, vtile.to_message()
+
+
+def iter_tasks(features, minzoom, maxzoom, layer_name='features',
+               path_multiplier=16, buffer=8):
+    """
+    Generate the render_tile tasks of a pyramid, zoom by zoom. buffer is
+    in pixels, as for VectorTile.
+    """
+    for z in range(minzoom, maxzoom + 1):
+        buckets = bucket_features(features, z, float(buffer or 0) / Request.size)
+        for (z, x, y) in sorted(buckets):
+            yield (z, x, y, layer_name, buckets[(z, x, y)], path_multiplier,
+                   buffer)
+
+
+def build_pyramid(features, minzoom, maxzoom, layer_name='features',
+                  processes=None, chunksize=1, path_multiplier=16, buffer=8):
+    """
+    Encode every non-empty tile from minzoom to maxzoom.
+
+    Yields (z, x, y, bytes) as tiles finish, in no particular order.
+    processes is the size of the worker pool and defaults to the number
+    of CPUs; with processes=1 tiles are encoded in this process. buffer
+    is passed on to VectorTile.
+    """
+    features = list(features)
+    tasks = iter_tasks(features, minzoom, maxzoom, layer_name=layer_name,
+                       path_multiplier=path_multiplier, buffer=buffer)
+    if processes == 1:
+        results = (render_tile(task) for task in tasks)
+        for result in results:
+            if result is not None:
+                yield result
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(render_tile, tasks, chunksize):
+            if result is not None:
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
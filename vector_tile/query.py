@@ -0,0 +1,117 @@
+"""
+Attribute filters and property projection evaluated on encoded tags.
+
+A feature's tags are pairs of indices into its layer's key and value
+tables. Query resolves its conditions against those tables once per
+layer, so deciding whether a feature matches only compares integers and
+its properties and geometry are decoded only when it does.
+
+Conditions in where map a key to:
+
+- a value, matched by equality
+- a list, tuple, set or frozenset of values, matching any of them
+- a callable taking a value and returning a truth value, called at most
+  once per distinct value index in the layer
+
+Equality follows Python, so 1 matches 1.0, except that booleans only
+match booleans. A feature lacking a key named in where never matches.
+"""
+
+
+def _matcher(wanted):
+    "Return a function testing whether a value equals one of wanted"
+    bools = frozenset(w for w in wanted if isinstance(w, bool))
+    others = frozenset(w for w in wanted if not isinstance(w, bool))
+    def matches(value):
+        if isinstance(value, bool):
+            return value in bools
+        return value in others
+    return matches
+
+
+class Query(object):
+    """
+    Feature filter and property projection.
+
+    where maps keys to conditions, see the module documentation, and
+    properties is an optional list of the keys to decode.
+    """
+    def __init__(self, where=None, properties=None):
+        self.where = {}
+        for key, cond in (where or {}).items():
+            if callable(cond):
+                self.where[key] = (True, cond)
+            elif isinstance(cond, (list, tuple, set, frozenset)):
+                self.where[key] = (False, _matcher(cond))
+            else:
+                self.where[key] = (False, _matcher([cond]))
+        self.properties = list(properties) if properties is not None else None
+
+    def resolve(self, keys, values):
+        """
+        Bind the query to a layer given its keys and its values as
+        Python values. Returns a LayerQuery, or None when no feature of
+        the layer can match.
+        """
+        # a key may be listed more than once in a layer's keys
+        key_index = {}
+        for i, k in enumerate(keys):
+            key_index.setdefault(k, set()).add(i)
+        tests = {}
+        for key, (lazy, test) in self.where.items():
+            indices = key_index.get(key)
+            if indices is None:
+                return None
+            if lazy:
+                test = _memoize(test, values)
+            else:
+                allowed = frozenset(j for j, v in enumerate(values) if test(v))
+                if not allowed:
+                    return None
+                test = allowed.__contains__
+            for i in indices:
+                tests[i] = test
+        keep = None
+        if self.properties is not None:
+            keep = frozenset(i for k in self.properties for i in key_index.get(k, ()))
+        return LayerQuery(tests, keep, len(self.where))
+
+
+def _memoize(test, values):
+    results = {}
+    def cached(index):
+        try:
+            return results[index]
+        except KeyError:
+            result = results[index] = bool(test(values[index]))
+            return result
+    return cached
+
+
+class LayerQuery(object):
+    """
+    A Query bound to one layer: tests maps key indices to functions of
+    the value index, keep is the set of key indices to decode, or None
+    for all, and required the number of conditions a feature must meet,
+    by default one per key index in tests
+    """
+    __slots__ = ('tests', 'keep', 'required')
+
+    def __init__(self, tests, keep=None, required=None):
+        self.tests = tests
+        self.keep = keep
+        self.required = len(tests) if required is None else required
+
+    def matches(self, tags):
+        "Whether a feature with tags passes every condition"
+        tests = self.tests
+        if not tests:
+            return True
+        found = 0
+        for i in range(0, len(tags), 2):
+            test = tests.get(tags[i])
+            if test is not None:
+                if not test(tags[i+1]):
+                    return False
+                found += 1
+        return found >= self.required
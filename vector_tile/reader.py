@@ -0,0 +1,385 @@
+"""
+Lazy reader for the vector tile protobuf wire format.
+
+TileReader wraps the serialized tile in a memoryview (a bytearray copy on
+Python 2, whose memoryview items are strings) and only records the byte
+ranges of layers and features as it meets them. Names, keys, values,
+tags and geometry are decoded when they are first accessed, so listing
+the layers of a tile or counting its features never materializes the
+features themselves.
+
+The reader objects mirror the attributes of the generated protobuf
+classes (name, version, extent, keys, values, features; id, tags, type,
+geometry), except that layer values are plain Python values rather than
+Tile.Value messages.
+"""
+
+import struct
+import sys
+
+# wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+# Tile
+TILE_LAYERS = 3
+# Tile.Layer
+LAYER_NAME = 1
+LAYER_FEATURES = 2
+LAYER_KEYS = 3
+LAYER_VALUES = 4
+LAYER_EXTENT = 5
+LAYER_VERSION = 15
+# Tile.Feature
+FEATURE_ID = 1
+FEATURE_TAGS = 2
+FEATURE_TYPE = 3
+FEATURE_GEOMETRY = 4
+
+
+if sys.version_info.major < 3:
+    # items of a Python 2 memoryview are one character strings, those of
+    # a bytearray are ints as read_varint expects
+    view = bytearray
+else:
+    view = memoryview
+
+
+def read_varint(buf, pos):
+    "Decode the varint at buf[pos], returning (value, new position)"
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def read_field(buf, pos):
+    """
+    Decode the field at buf[pos], returning (field number, wire type,
+    value, new position). value is an int for varint fields, a (start,
+    end) pair for length delimited fields and a view of the raw bytes for
+    fixed width fields.
+    """
+    key, pos = read_varint(buf, pos)
+    wire_type = key & 7
+    if wire_type == VARINT:
+        value, pos = read_varint(buf, pos)
+    elif wire_type == LENGTH_DELIMITED:
+        length, pos = read_varint(buf, pos)
+        value = (pos, pos + length)
+        pos += length
+    elif wire_type == FIXED64:
+        value = buf[pos:pos + 8]
+        pos += 8
+    elif wire_type == FIXED32:
+        value = buf[pos:pos + 4]
+        pos += 4
+    else:
+        raise ValueError("unsupported wire type: %d" % wire_type)
+    return key >> 3, wire_type, value, pos
+
+
+def iter_fields(buf, start, end):
+    """
+    Generate (field number, wire type, value) for the message in
+    buf[start:end], the values as read_field returns them
+    """
+    pos = start
+    while pos < end:
+        field, wire_type, value, pos = read_field(buf, pos)
+        yield field, wire_type, value
+    if pos != end:
+        raise ValueError("truncated message")
+
+
+def read_packed(buf, start, end):
+    "Decode a packed run of varints"
+    values = []
+    pos = start
+    while pos < end:
+        value, pos = read_varint(buf, pos)
+        values.append(value)
+    return values
+
+
+def _text(buf, span):
+    return bytes(buf[span[0]:span[1]]).decode('utf-8')
+
+
+def read_value(buf, start, end):
+    "Decode a Tile.Value message to the Python value it holds"
+    value = None
+    for field, wire_type, v in iter_fields(buf, start, end):
+        if field == 1:
+            value = _text(buf, v)
+        elif field == 2:
+            value = struct.unpack('<f', bytes(v))[0]
+        elif field == 3:
+            value = struct.unpack('<d', bytes(v))[0]
+        elif field == 4:
+            value = v - (1 << 64) if v >= (1 << 63) else v
+        elif field == 5:
+            value = v
+        elif field == 6:
+            value = (v >> 1) ^ -(v & 1)
+        elif field == 7:
+            value = bool(v)
+    return value
+
+
+class FeatureReader(object):
+    """
+    A feature whose fields are decoded on first access. Geometry is
+    decoded separately from the other fields, so filtering on tags
+    never touches it.
+    """
+    __slots__ = ('buf', 'start', 'end', '_id', '_tags', '_type', '_geometry',
+                 '_geometry_parts')
+
+    def __init__(self, buf, start, end):
+        self.buf = buf
+        self.start = start
+        self.end = end
+        self._id = None
+
+    def _decode(self):
+        self._id = 0
+        self._tags = []
+        self._type = 0
+        self._geometry = None
+        self._geometry_parts = []
+        buf = self.buf
+        for field, wire_type, v in iter_fields(buf, self.start, self.end):
+            if field == FEATURE_ID:
+                self._id = v
+            elif field == FEATURE_TYPE:
+                self._type = v
+            elif field == FEATURE_TAGS:
+                if wire_type == LENGTH_DELIMITED:
+                    self._tags.extend(read_packed(buf, *v))
+                else:
+                    self._tags.append(v)
+            elif field == FEATURE_GEOMETRY:
+                self._geometry_parts.append((wire_type, v))
+
+    @property
+    def id(self):
+        if self._id is None:
+            self._decode()
+        return self._id
+
+    @property
+    def tags(self):
+        if self._id is None:
+            self._decode()
+        return self._tags
+
+    @property
+    def type(self):
+        if self._id is None:
+            self._decode()
+        return self._type
+
+    @property
+    def geometry(self):
+        if self._id is None:
+            self._decode()
+        if self._geometry is None:
+            geometry = []
+            for wire_type, v in self._geometry_parts:
+                if wire_type == LENGTH_DELIMITED:
+                    geometry.extend(read_packed(self.buf, *v))
+                else:
+                    geometry.append(v)
+            self._geometry = geometry
+        return self._geometry
+
+
+class FeatureSequence(object):
+    """Sequence of the features of a layer, created on access"""
+    def __init__(self, buf, spans):
+        self.buf = buf
+        self.spans = spans
+
+    def __len__(self):
+        return len(self.spans)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [FeatureReader(self.buf, *span) for span in self.spans[index]]
+        return FeatureReader(self.buf, *self.spans[index])
+
+    def __iter__(self):
+        buf = self.buf
+        for start, end in self.spans:
+            yield FeatureReader(buf, start, end)
+
+
+class LayerReader(object):
+    """
+    A layer of a serialized tile.
+
+    Creating one costs nothing; the first attribute access walks the
+    layer's fields once, recording byte ranges without decoding them.
+    """
+    def __init__(self, buf, start, end):
+        self.buf = buf
+        self.start = start
+        self.end = end
+        self._indexed = False
+
+    def _index(self):
+        self._name = None
+        self._version = 1
+        self._extent = 4096
+        self._feature_spans = []
+        self._key_spans = []
+        self._value_spans = []
+        self._keys = None
+        self._values = None
+        self._value_cache = {}
+        buf = self.buf
+        repeated = {LAYER_FEATURES: self._feature_spans,
+                    LAYER_KEYS: self._key_spans,
+                    LAYER_VALUES: self._value_spans}
+        pos = self.start
+        end = self.end
+        while pos < end:
+            key = buf[pos]
+            spans = repeated.get(key >> 3) if key & 0x87 == LENGTH_DELIMITED else None
+            if spans is not None and buf[pos + 1] < 0x80:
+                # encoders write features, keys and values as runs of the
+                # same field, with the length of each usually fitting in a
+                # byte, so step along the run without decoding its keys
+                append = spans.append
+                length = buf[pos + 1]
+                while True:
+                    start = pos + 2
+                    pos = start + length
+                    append((start, pos))
+                    if pos >= end or buf[pos] != key:
+                        break
+                    length = buf[pos + 1]
+                    if length >= 0x80:
+                        break
+                continue
+            field, wire_type, v, pos = read_field(buf, pos)
+            if field in repeated:
+                repeated[field].append(v)
+            elif field == LAYER_NAME:
+                self._name = v
+            elif field == LAYER_EXTENT:
+                self._extent = v
+            elif field == LAYER_VERSION:
+                self._version = v
+        if pos != end:
+            raise ValueError("truncated message")
+        self._indexed = True
+
+    def _get(self, attr):
+        if not self._indexed:
+            self._index()
+        return getattr(self, attr)
+
+    @property
+    def name(self):
+        if self._indexed:
+            name = self._name
+        else:
+            # encoders write the name first, so this rarely walks far
+            name = None
+            for field, wire_type, v in iter_fields(self.buf, self.start, self.end):
+                if field == LAYER_NAME:
+                    name = v
+                    break
+        return _text(self.buf, name) if name is not None else u''
+
+    @property
+    def version(self):
+        return self._get('_version')
+
+    @property
+    def extent(self):
+        return self._get('_extent')
+
+    @property
+    def keys(self):
+        if self._get('_keys') is None:
+            self._keys = [_text(self.buf, span) for span in self._key_spans]
+        return self._keys
+
+    @property
+    def values(self):
+        if self._get('_values') is None:
+            self._values = [read_value(self.buf, *span)
+                            for span in self._value_spans]
+        return self._values
+
+    def key(self, index):
+        "The key at index"
+        return self.keys[index]
+
+    def value(self, index):
+        "The value at index, decoding only that one"
+        if self._get('_values') is not None:
+            return self._values[index]
+        cache = self._value_cache
+        try:
+            return cache[index]
+        except KeyError:
+            value = cache[index] = read_value(self.buf, *self._value_spans[index])
+            return value
+
+    @property
+    def features(self):
+        return FeatureSequence(self.buf, self._get('_feature_spans'))
+
+    def __len__(self):
+        return len(self._get('_feature_spans'))
+
+    def raw(self):
+        "The serialized Tile.Layer message, as a memoryview"
+        return memoryview(self.buf)[self.start:self.end]
+
+
+class TileReader(object):
+    """
+    Read-only view of a serialized tile.
+
+    data may be any object supporting the buffer protocol; it is not
+    copied. When layers is given only the layers named in it are
+    read; the others are skipped without being indexed.
+    """
+    def __init__(self, data, layers=None):
+        self.buf = view(data)
+        self.wanted = set(layers) if layers is not None else None
+        self._layers = None
+
+    @property
+    def layers(self):
+        if self._layers is None:
+            self._layers = [
+                LayerReader(self.buf, *v)
+                for field, wire_type, v in iter_fields(self.buf, 0, len(self.buf))
+                if field == TILE_LAYERS]
+            if self.wanted is not None:
+                self._layers = [layer for layer in self._layers
+                                if layer.name in self.wanted]
+        return self._layers
+
+    def layer_names(self):
+        return [layer.name for layer in self.layers]
+
+    def layer(self, name):
+        "Return the layer called name, or None"
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+        return None
@@ -1,17 +1,36 @@
 #!/usr/bin/env python
 
 import sys
-import gzip
 import json
 import os
 import math
+from collections import OrderedDict
+import numpy as np
+from . import geometry
+from .compression import compress, decompress
+from .query import Query
+from .reader import LayerReader, TileReader
+from .stats import clock
 from . import vector_tile_pb2
 
 is_python3 = sys.version_info.major == 3
 if is_python3:
     unicode = str
 
-class Box2d(object):
+class Immutable(object):
+    """
+    Base for slotted value objects whose attributes are set once in
+    __init__ through object.__setattr__ and never change afterwards.
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+    def __delattr__(self, name):
+        raise AttributeError("%s is immutable" % type(self).__name__)
+
+class Box2d(Immutable):
     """Box2d object to represent floating point bounds as
 
         minx,miny,maxx,maxy
@@ -21,11 +40,26 @@ class Box2d(object):
         left,bottom,right,top
         west,south,east,north
     """
+    __slots__ = ('minx', 'miny', 'maxx', 'maxy')
+
     def __init__(self,minx,miny,maxx,maxy):
-        self.minx = float(minx)
-        self.miny = float(miny)
-        self.maxx = float(maxx)
-        self.maxy = float(maxy)
+        setattr_ = object.__setattr__
+        setattr_(self, 'minx', float(minx))
+        setattr_(self, 'miny', float(miny))
+        setattr_(self, 'maxx', float(maxx))
+        setattr_(self, 'maxy', float(maxy))
+
+    def __reduce__(self):
+        return (Box2d, tuple(self.bounds()))
+
+    def __eq__(self, other):
+        return isinstance(other, Box2d) and self.bounds() == other.bounds()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(self.bounds()))
 
     def width(self):
         return self.maxx - self.minx
@@ -47,6 +81,10 @@ MAX_EXTENT = 20037508.342789244
 DEG_TO_RAD = math.pi/180
 RAD_TO_DEG = 180/math.pi
 
+# command streams up to this many integers, about 80 vertices, decode
+# faster one vertex at a time than through numpy arrays
+SCALAR_GEOMETRY = 160
+
 def lonlat2merc(lon,lat):
     "Convert coordinate pair from epsg:4326 to epsg:3857"
     x = lon * MAX_EXTENT / 180
@@ -61,11 +99,115 @@ def merc2lonlat(x,y):
     y = RAD_TO_DEG * (2 * math.atan(math.exp(y * DEG_TO_RAD)) - math.pi/2);
     return x,y
 
+def lonlat2merc_array(lon,lat):
+    "Convert arrays of coordinates from epsg:4326 to epsg:3857"
+    x = np.asarray(lon, dtype=np.float64) * MAX_EXTENT / 180
+    y = np.log(np.tan((90 + np.asarray(lat, dtype=np.float64)) * math.pi / 360)) / DEG_TO_RAD
+    y = y * MAX_EXTENT / 180
+    return x,y
+
+def merc2lonlat_array(x,y):
+    "Convert arrays of coordinates from epsg:3857 to epsg:4326"
+    x = (np.asarray(x, dtype=np.float64) / MAX_EXTENT) * 180
+    y = (np.asarray(y, dtype=np.float64) / MAX_EXTENT) * 180
+    y = RAD_TO_DEG * (2 * np.arctan(np.exp(y * DEG_TO_RAD)) - math.pi/2)
+    return x,y
+
+# Python type of an attribute value -> Tile.Value field it is stored in
+value_fields = {
+    bool: 'bool_value',
+    unicode: 'string_value',
+    int: 'int_value',
+    float: 'double_value' }
+
+def value_key(v):
+    """
+    Return the interning key of an attribute value.
+
+    The key pairs the value with its type so that values which compare
+    equal in Python (True and 1, 1 and 1.0) map to distinct Tile.Value
+    entries.
+    """
+    if isinstance(v,bool):
+        return (bool,v)
+    elif isinstance(v,str) or isinstance(v,unicode):
+        return (unicode,v)
+    elif isinstance(v,int):
+        return (int,v)
+    elif isinstance(v,float):
+        return (float,v)
+    raise Exception("Unknown value type: '%s'" % type(v))
+
+def decode_value(val):
+    "Convert a Tile.Value message to the Python value it holds"
+    if val.HasField('bool_value'):
+        return val.bool_value
+    elif val.HasField('string_value'):
+        return val.string_value
+    elif val.HasField('int_value'):
+        return val.int_value
+    elif val.HasField('sint_value'):
+        return val.sint_value
+    elif val.HasField('uint_value'):
+        return val.uint_value
+    elif val.HasField('float_value'):
+        return val.float_value
+    elif val.HasField('double_value'):
+        return val.double_value
+    raise Exception("Unknown value type: '%s'" % val)
+
+def _fill_points(layer, ids, xs, ys, tags=None, counts=None):
+    """
+    Add point features to layer. xs and ys are the zigzag encoded
+    coordinates, tags the tag indices of all features back to back and
+    counts the number of properties of each.
+    """
+    if counts is None:
+        counts = np.zeros(len(ids), dtype=np.int64)
+    ends = np.cumsum(2 * np.asarray(counts, dtype=np.int64)).tolist()
+    start = 0
+    moveto = (1 << geometry.CMD_BITS) | geometry.SEG_MOVETO
+    add = layer.features.add
+    for fid, x, y, end in zip(ids.tolist(), xs.tolist(), ys.tolist(), ends):
+        f = add()
+        f.id = fid
+        if end > start:
+            f.tags.extend(tags[start:end])
+            start = end
+        f.type = vector_tile_pb2.Tile.POINT
+        f.geometry.extend((moveto, x, y))
+
 def minmax(a,b,c):
     a = max(a,b)
     a = min(a,c)
     return a
 
+def write_geojson(fp, features, newline_delimited=False):
+    """
+    Write GeoJSON features to the text file object fp one at a time.
+
+    features may be any iterable, for example the chained
+    iter_geojson_features() of many tiles. The output is a
+    FeatureCollection, or one feature per line when newline_delimited is
+    set. Returns the number of features written.
+    """
+    count = 0
+    if newline_delimited:
+        for fobj in features:
+            fp.write(json.dumps(fobj))
+            fp.write('\n')
+            count += 1
+    else:
+        fp.write('{"type": "FeatureCollection", "features": [')
+        for fobj in features:
+            if count:
+                fp.write(',')
+            fp.write('\n')
+            fp.write(json.dumps(fobj))
+            count += 1
+        fp.write('\n]}\n')
+    return count
+
 class SphericalMercator(object):
     """
     Core definition of Spherical Mercator Projection.
@@ -87,6 +229,11 @@ class SphericalMercator(object):
             self.zc.append((e,e))
             self.Ac.append(size)
             size *= 2.0
+        # lookup tables are shared between requests, so freeze them
+        self.Bc = tuple(self.Bc)
+        self.Cc = tuple(self.Cc)
+        self.zc = tuple(self.zc)
+        self.Ac = tuple(self.Ac)
 
     def ll_to_px(self, px, zoom):
         """ Convert LatLong (EPSG:4326) to pixel postion """
@@ -104,6 +251,22 @@ class SphericalMercator(object):
         h = RAD_TO_DEG * ( 2 * math.atan(math.exp(g)) - 0.5 * math.pi)
         return (f,h)
 
+    def ll_to_px_array(self, lon, lat, zoom):
+        """ Convert arrays of LatLong (EPSG:4326) to pixel postions """
+        d = self.zc[zoom]
+        e = np.round(d[0] + np.asarray(lon, dtype=np.float64) * self.Bc[zoom])
+        f = np.clip(np.sin(DEG_TO_RAD * np.asarray(lat, dtype=np.float64)),-0.9999,0.9999)
+        g = np.round(d[1] + 0.5 * np.log((1+f)/(1-f))*-self.Cc[zoom])
+        return e,g
+
+    def px_to_ll_array(self, x, y, zoom):
+        """ Convert arrays of pixel postions to LatLong (EPSG:4326) """
+        e = self.zc[zoom]
+        f = (np.asarray(x, dtype=np.float64) - e[0])/self.Bc[zoom]
+        g = (np.asarray(y, dtype=np.float64) - e[1])/-self.Cc[zoom]
+        h = RAD_TO_DEG * ( 2 * np.arctan(np.exp(g)) - 0.5 * math.pi)
+        return f,h
+
     def bbox(self, x, y, zoom):
         """ Convert XYZ to extent in mercator """
         ll = (x * self.size,(y + 1) * self.size)
@@ -127,23 +290,125 @@ class SphericalMercator(object):
                 int(math.floor((px_ll[1]-1)/self.size))
                ]
 
-class Request(object):
+    def xyz_array(self, bboxes, zoom):
+        """
+        Convert an (n, 4) array of mercator extents to an (n, 4) int
+        array of XYZ extents
+        """
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        lon0,lat0 = merc2lonlat_array(bboxes[:,0],bboxes[:,1])
+        lon1,lat1 = merc2lonlat_array(bboxes[:,2],bboxes[:,3])
+        px_ll = self.ll_to_px_array(lon0,lat0,zoom)
+        px_ur = self.ll_to_px_array(lon1,lat1,zoom)
+        return np.column_stack((
+            np.floor(px_ll[0]/self.size),
+            np.floor(px_ur[1]/self.size),
+            np.floor((px_ur[0]-1)/self.size),
+            np.floor((px_ll[1]-1)/self.size))).astype(np.int64)
+
+_mercators = {}
+
+def get_mercator(levels=22, size=256):
+    """
+    Return the shared SphericalMercator for levels and size.
+
+    Its lookup tables are immutable, so one instance per configuration
+    serves every request.
+    """
+    key = (levels,size)
+    merc = _mercators.get(key)
+    if merc is None:
+        merc = _mercators[key] = SphericalMercator(levels=levels,size=size)
+    return merc
+
+class LRUCache(object):
+    """
+    Mapping with bounded size that evicts the least recently used entry.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self.data.pop(key)
+        except KeyError:
+            return default
+        self.data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.data.pop(key, None)
+        self.data[key] = value
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def __len__(self):
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+
+# (x, y, zoom, size) -> Box2d of recently requested tiles
+EXTENT_CACHE_SIZE = 65536
+_extents = LRUCache(EXTENT_CACHE_SIZE)
+
+def tile_extent(x, y, zoom, size=256):
+    "Return the mercator Box2d of tile x,y,zoom, memoized"
+    key = (x,y,zoom,size)
+    extent = _extents.get(key)
+    if extent is None:
+        extent = _extents[key] = Box2d(
+            *get_mercator(levels=22,size=size).bbox(x,y,zoom))
+    return extent
+
+class Request(Immutable):
     """
     Request encapulates a single tile request in the common OSM, aka XYZ scheme.
 
-    Interally we convert the x,y,zoom to a mercator bounding box assuming a 256 pixel tile
+    Interally we convert the x,y,zoom to a mercator bounding box assuming a 256 pixel tile.
+    The box is looked up on first use, so a Request costs little more than its three ints;
+    see TileGrid for holding many of them.
     """
+    __slots__ = ('x', 'y', 'zoom', '_extent')
+
+    size = 256
+    mercator = get_mercator(levels=22,size=256)
+
     def __init__(self, x, y, zoom):
         assert isinstance(zoom,int)
         assert zoom <= 22
         assert isinstance(x,int)
         assert isinstance(y,int)
-        self.x = x
-        self.y = y
-        self.zoom = zoom
-        self.size = 256
-        self.mercator = SphericalMercator(levels=22,size=self.size)
-        self.extent = Box2d(*self.mercator.bbox(x,y,zoom))
+        setattr_ = object.__setattr__
+        setattr_(self, 'x', x)
+        setattr_(self, 'y', y)
+        setattr_(self, 'zoom', zoom)
+        setattr_(self, '_extent', None)
+
+    def __reduce__(self):
+        return (Request, (self.x, self.y, self.zoom))
+
+    def __eq__(self, other):
+        return (isinstance(other, Request) and self.x == other.x and
+                self.y == other.y and self.zoom == other.zoom)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.x, self.y, self.zoom))
+
+    def __repr__(self):
+        return 'Request(%d,%d,%d)' % (self.x, self.y, self.zoom)
+
+    @property
+    def extent(self):
+        extent = self._extent
+        if extent is None:
+            extent = tile_extent(self.x,self.y,self.zoom,self.size)
+            object.__setattr__(self, '_extent', extent)
+        return extent
 
     def get_extent(self):
         return self.extent
@@ -157,29 +422,131 @@ class Request(object):
     def bounds(self):
         return self.extent.bounds()
 
-class CoordTransform(object):
+class CoordTransform(Immutable):
     """
     CoordTransform provides methods for converting coordinate pairs
     to and from a geographical coordinate system (usually mercator)
     to screen or pixel coordinates for a given tile request.
+
+    The affine coefficients, origin (ox, oy) and scale (sx, sy), are
+    stored flat so a transform reads no other object.
     """
+    __slots__ = ('extent', 'ox', 'oy', 'sx', 'sy')
+
     def __init__(self,request):
         assert isinstance(request,Request)
-        self.extent = request.get_extent()
-        self.sx = (float(request.size) / request.get_width())
-        self.sy = (float(request.size) / request.get_height())
+        extent = request.get_extent()
+        setattr_ = object.__setattr__
+        setattr_(self, 'extent', extent)
+        setattr_(self, 'ox', extent.minx)
+        setattr_(self, 'oy', extent.maxy)
+        setattr_(self, 'sx', float(request.size) / extent.width())
+        setattr_(self, 'sy', float(request.size) / extent.height())
 
     def forward(self,x,y):
         """Geo coordinates to Screen coordinates"""
-        x0 = (x - self.extent.minx) * self.sx
-        y0 = (self.extent.maxy - y) * self.sy
-        return x0,y0
+        return (x - self.ox) * self.sx, (self.oy - y) * self.sy
 
     def backward(self,x,y):
         """Screen coordinates to Geo coordinates"""
-        x0 = self.extent.minx + x / self.sx
-        y0 = self.extent.maxy - y / self.sy
-        return x0,y0
+        return self.ox + x / self.sx, self.oy - y / self.sy
+
+class TileGrid(object):
+    """
+    Packed sequence of tile addresses.
+
+    Holds x, y and zoom in numpy arrays, about 9 bytes a tile, where a
+    list of Request objects costs tens of times more. Indexing with an
+    int gives a Request; slices, masks and index arrays give a TileGrid.
+    """
+    __slots__ = ('x', 'y', 'zoom')
+
+    def __init__(self, x, y, zoom):
+        self.x = np.asarray(x, dtype=np.uint32)
+        self.y = np.asarray(y, dtype=np.uint32)
+        self.zoom = np.broadcast_to(np.asarray(zoom, dtype=np.uint8), self.x.shape).copy()
+        if not (self.x.shape == self.y.shape and self.x.ndim == 1):
+            raise ValueError("x and y must be 1d arrays of the same length")
+        if len(self.zoom) and self.zoom.max() > 22:
+            raise ValueError("zoom must be at most 22")
+
+    @classmethod
+    def from_range(cls, zoom, minx, miny, maxx, maxy):
+        "All tiles at zoom with minx <= x <= maxx and miny <= y <= maxy"
+        xs = np.arange(minx, maxx + 1, dtype=np.uint32)
+        ys = np.arange(miny, maxy + 1, dtype=np.uint32)
+        return cls(np.repeat(xs, len(ys)), np.tile(ys, len(xs)), zoom)
+
+    @classmethod
+    def from_tiles(cls, tiles):
+        "Pack an iterable of (zoom, x, y) tuples"
+        zxy = np.array(list(tiles), dtype=np.int64).reshape(-1, 3)
+        return cls(zxy[:,1], zxy[:,2], zxy[:,0])
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            return Request(int(self.x[index]), int(self.y[index]), int(self.zoom[index]))
+        return TileGrid(self.x[index], self.y[index], self.zoom[index])
+
+    def __iter__(self):
+        for x, y, zoom in zip(self.x.tolist(), self.y.tolist(), self.zoom.tolist()):
+            yield Request(x, y, zoom)
+
+    @property
+    def nbytes(self):
+        return self.x.nbytes + self.y.nbytes + self.zoom.nbytes
+
+    def extents(self):
+        """
+        Mercator bounds of every tile as an (n, 4) array of minx, miny,
+        maxx, maxy, computed like SphericalMercator.bbox
+        """
+        size = float(Request.size)
+        scale = size * 2.0 ** self.zoom.astype(np.float64)
+        x = self.x.astype(np.float64)
+        y = self.y.astype(np.float64)
+        # pixel coordinates to lon/lat for each zoom, as px_to_ll_array
+        e = scale / 2
+        bc = scale / 360.0
+        cc = scale / (2.0 * math.pi)
+        def to_merc(px, py):
+            lon = (px - e) / bc
+            lat = RAD_TO_DEG * (2 * np.arctan(np.exp((py - e) / -cc)) - 0.5 * math.pi)
+            return lonlat2merc_array(lon, lat)
+        minx,miny = to_merc(x * size, (y + 1) * size)
+        maxx,maxy = to_merc((x + 1) * size, y * size)
+        return np.column_stack((minx,miny,maxx,maxy))
+
+class GeoJSONFeatures(object):
+    """
+    Sequence of the GeoJSON features of a layer of a VectorTile,
+    decoded one at a time on access, see VectorTile.features
+    """
+    def __init__(self, vtile, layer, lonlat=False, layer_names=False):
+        self.vtile = vtile
+        self.layer = layer
+        self.lonlat = lonlat
+        self.layer_names = layer_names
+        self.lookup = vtile._tag_lookup(layer)
+
+    def _decode(self, feat):
+        return self.vtile.geojson_feature(self.layer, feat, self.lonlat,
+                                          self.layer_names, self.lookup)
+
+    def __len__(self):
+        return len(self.layer.features)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._decode(feat) for feat in self.layer.features[index]]
+        return self._decode(self.layer.features[index])
+
+    def __iter__(self):
+        for feat in self.layer.features:
+            yield self._decode(feat)
 
 class VectorTile(object):
     """
@@ -188,31 +555,89 @@ class VectorTile(object):
     transport over the wire and later rendering by MapBox tools.
 
     """
-    def __init__(self, req, tile=None, path_multiplier=16):
+    def __init__(self, req, tile=None, path_multiplier=16, buffer=8, simplify=None,
+                 stats=None):
         assert isinstance(req,Request)
         self.request = req
         self.extent = self.request.extent
         self.ctrans = CoordTransform(req)
         self.path_multiplier = path_multiplier
+        # lines and polygons are clipped to the tile grown by buffer
+        # pixels on every side; None disables clipping
+        self.buffer = buffer
+        # Douglas-Peucker tolerance for lines and polygons in pixels, so
+        # the same value removes more detail at lower zooms
+        self.simplify = simplify
+        # vertices dropped by simplification and repeated point removal
+        self.removed_vertices = 0
+        # optional stats.Stats collecting stage timings and counters
+        self.stats = stats
+        # per layer map of packed point coordinate -> feature index
         self.pixels = {}
+        # per layer interning tables: key -> index and (type, value) -> index,
+        # built on the first write to a layer of a loaded tile
         self.keys = {}
         self.values = {}
         self.feature_count = 0
         if tile:
             self.tile = tile
             for layer in self.tile.layers:
-                self.pixels[layer.name] = []
+                self.pixels[layer.name] = {}
                 self.feature_count += len(layer.features)
-                self.keys[layer.name] = layer.keys
-                self.values[layer.name] = layer.values
         else:
             self.tile = vector_tile_pb2.Tile()
 
     def __str__(self):
         return self.tile.__str__()
 
-    def to_message(self):
-        return self.tile.SerializeToString()
+    def to_message(self, compression=None, level=None):
+        """
+        Serialize the tile, optionally compressed with 'gzip', 'zlib'
+        or 'zstd' at level
+        """
+        stats = self.stats
+        if stats is None:
+            return compress(self.tile.SerializeToString(), compression, level)
+        t = clock()
+        data = self.tile.SerializeToString()
+        t = stats.lap('serialization', t)
+        data = compress(data, compression, level)
+        stats.lap('compression', t)
+        return data
+
+    @classmethod
+    def from_message(cls, req, data, **kwargs):
+        """
+        Load a VectorTile from a serialized tile, detecting and undoing
+        any compression supported by to_message
+        """
+        stats = kwargs.get('stats')
+        if stats is not None:
+            t = clock()
+        tile = vector_tile_pb2.Tile()
+        tile.ParseFromString(decompress(data))
+        if stats is not None:
+            stats.lap('parsing', t)
+        return cls(req, tile, **kwargs)
+
+    @classmethod
+    def from_bytes(cls, req, data, layers=None, **kwargs):
+        """
+        Load a read-only VectorTile that reads the serialized tile lazily.
+
+        Only the layers named in layers, or all when it is None, are
+        read, and a layer is only indexed, feature by feature, when first
+        used. Tags and geometry of a feature are decoded when accessed,
+        see features(). Compression is handled as by from_message.
+        """
+        vtile = cls(req, **kwargs)
+        stats = vtile.stats
+        if stats is not None:
+            t = clock()
+        vtile.tile = TileReader(decompress(data), layers=layers)
+        if stats is not None:
+            stats.lap('parsing', t)
+        return vtile
 
     def _decode_coords(self, dx, dy):
         x = ((dx >> 1) ^ (-(dx & 1)))
@@ -222,7 +647,12 @@ class VectorTile(object):
         return x,y
 
     def _encode_coords(self, x, y, rint=False):
+        stats = self.stats
+        if stats is not None:
+            t = clock()
         dx,dy = self.ctrans.forward(x,y)
+        if stats is not None:
+            t = stats.lap('projection', t)
         if rint:
             dx = int(round(dx * self.path_multiplier))
             dy = int(round(dy * self.path_multiplier))
@@ -231,177 +661,638 @@ class VectorTile(object):
             dy = int(math.floor(dy * self.path_multiplier))
         dxi = (dx << 1) ^ (dx >> 31)
         dyi = (dy << 1) ^ (dy >> 31)
+        if stats is not None:
+            stats.lap('quantization', t)
         return dxi,dyi
 
-    def add_point(self, layer, x, y, properties,skip_coincident=True,rint=False):
+    def _quantize(self, xs, ys, rint=False):
+        """
+        Project arrays of geo coordinates to int64 arrays of tile
+        coordinates, the array counterpart of _encode_coords before
+        zigzag encoding
+        """
+        stats = self.stats
+        if stats is not None:
+            t = clock()
+        dx,dy = self.ctrans.forward(np.asarray(xs, dtype=np.float64),
+                                    np.asarray(ys, dtype=np.float64))
+        if stats is not None:
+            t = stats.lap('projection', t)
+        if rint:
+            dx = np.round(dx * self.path_multiplier)
+            dy = np.round(dy * self.path_multiplier)
+        else:
+            dx = np.floor(dx * self.path_multiplier)
+            dy = np.floor(dy * self.path_multiplier)
+        dx = dx.astype(np.int64)
+        dy = dy.astype(np.int64)
+        if stats is not None:
+            stats.lap('quantization', t)
+        return dx, dy
+
+    def add_point(self, layer, x, y, properties,skip_coincident=True,rint=False,keep_last=False):
+        """
+        Add a point feature to layer.
+
+        With skip_coincident points that quantize to the same tile
+        coordinate as an earlier point in the layer are dropped. When
+        keep_last is also set the earlier feature is kept in place but
+        takes the properties of the newer point instead.
+        """
         if self.extent.intersects(x,y):
+            stats = self.stats
             dx,dy = self._encode_coords(x,y,rint=rint)
-            # TODO - use numpy matrix to "paint" points so we
-            # can drop all coincident ones except last
-            key = "%d-%d" % (dx,dy)
-            if key not in self.pixels[layer.name]:
-                f = layer.features.add()
-                self.feature_count += 1
-                f.id = self.feature_count
-                f.type = self.tile.POINT
-                self._handle_attr(layer,f,properties)
-                f.geometry.append((1 << 3) | (1 & ((1 << 3) - 1)))
-                f.geometry.append(dx)
-                f.geometry.append(dy)
-                self.pixels[layer.name].append(key)
-                return True
+            if skip_coincident:
+                if stats is not None:
+                    t = clock()
+                pixels = self.pixels[layer.name]
+                # zigzag encoded coordinates are non-negative and fit in
+                # 32 bits, so pack them into a single int key
+                key = (dx << 32) | dy
+                index = pixels.get(key)
+                if stats is not None:
+                    stats.lap('dedup', t)
+                if index is not None:
+                    if stats is not None:
+                        stats.add('coincident_dropped')
+                    if not keep_last:
+                        return False
+                    self._handle_attr(layer,layer.features[index],properties)
+                    return True
+            tags = self._tags(layer, properties)
+            if skip_coincident:
+                pixels[key] = len(layer.features)
+            f = layer.features.add()
+            self.feature_count += 1
+            f.id = self.feature_count
+            f.type = self.tile.POINT
+            f.tags.extend(tags)
+            f.geometry.append((1 << 3) | (1 & ((1 << 3) - 1)))
+            f.geometry.append(dx)
+            f.geometry.append(dy)
+            if stats is not None:
+                stats.add('features')
+                stats.add('vertices')
+            return True
         else:
             raise RuntimeError("point does not intersect with tile bounds")
-        return False
+
+    def add_points(self, layer, xs, ys, properties_seq=None,
+                   skip_coincident=True, rint=False, keep_last=False):
+        """
+        Add many point features to layer at once.
+
+        xs and ys are sequences of mercator coordinates (numpy arrays or
+        anything numpy.asarray accepts) and properties_seq an optional
+        sequence of property dicts aligned with them. Clipping, projection,
+        quantization, zigzag encoding and coincident point suppression run
+        as array operations, and properties are interned in one pass before
+        the features are filled in.
+
+        Unlike add_point, points outside the tile are skipped rather than
+        raising. Returns a boolean array marking the points whose
+        properties were written to the layer.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        ext = self.extent
+        accepted = np.zeros(len(xs), dtype=bool)
+        index = np.flatnonzero((xs >= ext.minx) & (xs <= ext.maxx) &
+                               (ys >= ext.miny) & (ys <= ext.maxy))
+        dx,dy = self._quantize(xs[index], ys[index], rint=rint)
+        dx = (dx << 1) ^ (dx >> 31)
+        dy = (dy << 1) ^ (dy >> 31)
+
+        # each accepted feature as (position in index, position whose
+        # properties it takes)
+        stats = self.stats
+        if stats is not None:
+            t = clock()
+        if skip_coincident:
+            pixels = self.pixels[layer.name]
+            keys = (dx << 32) | dy
+            _, first, inverse = np.unique(
+                keys, return_index=True, return_inverse=True)
+            if keep_last:
+                last = np.zeros(len(first), dtype=np.int64)
+                last[inverse] = np.arange(len(keys))
+            else:
+                last = first
+            order = np.argsort(first)
+            first = first[order]
+            last = last[order]
+            keys = keys[first]
+            if pixels:
+                known = np.fromiter((k in pixels for k in keys.tolist()),
+                                    dtype=bool, count=len(keys))
+            else:
+                known = np.zeros(len(keys), dtype=bool)
+            if keep_last:
+                for key, j in zip(keys[known].tolist(), last[known].tolist()):
+                    f = layer.features[pixels[key]]
+                    if properties_seq is None:
+                        del f.tags[:]
+                    else:
+                        self._handle_attr(layer, f, properties_seq[index[j]])
+                    accepted[index[j]] = True
+            fresh = ~known
+            pos = np.column_stack((first[fresh], last[fresh]))
+            base = len(layer.features)
+            pixels.update(zip(keys[fresh].tolist(), range(base, base + len(pos))))
+        else:
+            pos = np.column_stack((np.arange(len(index)),) * 2)
+        n = len(pos)
+        if stats is not None:
+            t = stats.lap('dedup', t)
+            stats.add('coincident_dropped', len(index) - n)
+
+        ids = np.arange(self.feature_count + 1, self.feature_count + n + 1)
+        tags = counts = None
+        if properties_seq is not None:
+            tags, counts = self._intern_block(
+                layer, [properties_seq[j] for j in index[pos[:,1]].tolist()])
+            if stats is not None:
+                t = stats.lap('attributes', t)
+        gx = dx[pos[:,0]]
+        gy = dy[pos[:,0]]
+        _fill_points(layer, ids, gx, gy, tags, counts)
+        self.feature_count += n
+        accepted[index[pos[:,1]]] = True
+        if stats is not None:
+            stats.lap('encoding', t)
+            stats.add('features', n)
+            stats.add('vertices', n)
+        return accepted
+
+    def clip_box(self):
+        "The clipping box in tile coordinates, or None when not clipping"
+        if self.buffer is None:
+            return None
+        lo = -self.buffer * self.path_multiplier
+        hi = (self.request.size + self.buffer) * self.path_multiplier
+        return (lo, lo, hi, hi)
+
+    def _add_parts(self, layer, geom_type, parts, properties, closed, rint):
+        arrays = [np.asarray(part, dtype=np.float64).reshape(-1, 2) for part in parts]
+        coords = np.concatenate(arrays)
+        offsets = np.concatenate(([0], np.cumsum([len(a) for a in arrays])))
+        dx,dy = self._quantize(coords[:,0], coords[:,1], rint=rint)
+        stats = self.stats
+        if stats is not None:
+            t = clock()
+        tolerance = None
+        if self.simplify:
+            tolerance = self.simplify * self.path_multiplier
+        coords, offsets, removed = geometry.prepare_parts(
+            np.column_stack((dx,dy)), offsets, closed=closed,
+            clip=self.clip_box(), tolerance=tolerance)
+        self.removed_vertices += removed
+        if stats is not None:
+            stats.add('removed_vertices', removed)
+        if not len(coords):
+            if stats is not None:
+                stats.lap('geometry', t)
+                stats.add('dropped_features')
+            return None
+        cmds = geometry.encode_geometry(coords, offsets, closed).tolist()
+        if stats is not None:
+            stats.lap('geometry', t)
+        tags = self._tags(layer, properties)
+        f = layer.features.add()
+        self.feature_count += 1
+        f.id = self.feature_count
+        f.type = geom_type
+        f.tags.extend(tags)
+        if stats is not None:
+            t = clock()
+        f.geometry.extend(cmds)
+        if stats is not None:
+            stats.lap('encoding', t)
+            stats.add('features')
+            stats.add('vertices', len(coords))
+        return f
+
+    def add_line(self, layer, coords, properties, rint=False):
+        """
+        Add a line string feature to layer from a sequence of geo
+        coordinate pairs. Returns the new feature, or None when nothing
+        is left after clipping.
+        """
+        return self._add_parts(layer, self.tile.LINESTRING, [coords],
+                               properties, False, rint)
+
+    def add_polygon(self, layer, rings, properties, rint=False):
+        """
+        Add a polygon feature to layer from a sequence of rings of geo
+        coordinate pairs, exterior ring first
+        """
+        return self._add_parts(layer, self.tile.POLYGON, rings,
+                               properties, True, rint)
+
+    def add_multipoint(self, layer, coords, properties, rint=False):
+        """
+        Add a multipoint feature to layer from a sequence of geo
+        coordinate pairs
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        dx,dy = self._quantize(coords[:,0], coords[:,1], rint=rint)
+        bbox = self.clip_box()
+        if bbox is not None:
+            inside = (dx >= bbox[0]) & (dx <= bbox[2]) & (dy >= bbox[1]) & (dy <= bbox[3])
+            dx = dx[inside]
+            dy = dy[inside]
+            if not len(dx):
+                if self.stats is not None:
+                    self.stats.add('dropped_features')
+                return None
+        tags = self._tags(layer, properties)
+        f = layer.features.add()
+        self.feature_count += 1
+        f.id = self.feature_count
+        f.type = self.tile.POINT
+        f.tags.extend(tags)
+        f.geometry.extend(geometry.encode_points(np.column_stack((dx,dy))).tolist())
+        if self.stats is not None:
+            self.stats.add('features')
+            self.stats.add('vertices', len(dx))
+        return f
+
+    def add_multiline(self, layer, lines, properties, rint=False):
+        """
+        Add a multi line string feature to layer from a sequence of
+        lines of geo coordinate pairs
+        """
+        return self._add_parts(layer, self.tile.LINESTRING, lines,
+                               properties, False, rint)
+
+    def add_multipolygon(self, layer, polygons, properties, rint=False):
+        """
+        Add a multipolygon feature to layer from a sequence of polygons,
+        each a sequence of rings
+        """
+        rings = [ring for polygon in polygons for ring in polygon]
+        return self._add_parts(layer, self.tile.POLYGON, rings,
+                               properties, True, rint)
+
+    def add_feature(self, layer, geom, properties, rint=False):
+        """
+        Add a feature to layer from a GeoJSON-like geometry mapping in
+        geo coordinates. Multi-part geometries become a single feature.
+        """
+        gtype = geom['type']
+        coords = geom['coordinates']
+        if gtype == 'Point':
+            return self.add_point(layer, coords[0], coords[1], properties, rint=rint)
+        elif gtype == 'MultiPoint':
+            return self.add_multipoint(layer, coords, properties, rint=rint)
+        elif gtype == 'LineString':
+            return self.add_line(layer, coords, properties, rint=rint)
+        elif gtype == 'MultiLineString':
+            return self.add_multiline(layer, coords, properties, rint=rint)
+        elif gtype == 'Polygon':
+            return self.add_polygon(layer, coords, properties, rint=rint)
+        elif gtype == 'MultiPolygon':
+            return self.add_multipolygon(layer, coords, properties, rint=rint)
+        raise Exception("Unknown geometry type: '%s'" % gtype)
 
     def add_layer(self, name, version=1):
         layer = self.tile.layers.add()
         layer.name = name
         layer.version = version
         layer.extent = self.request.size * self.path_multiplier # == 4096
-        self.pixels[layer.name] = []
-        self.keys[layer.name] = []
-        self.values[layer.name] = []
+        self.pixels[layer.name] = {}
+        self.keys[layer.name] = {}
+        self.values[layer.name] = {}
         return layer
 
+    def geometry_arrays(self, feature, lonlat=False):
+        """
+        Decode a feature's geometry to coordinate arrays.
+
+        Returns (coords, offsets) where coords is an (n, 2) float array in
+        mercator, or lon/lat when lonlat is set, and part i spans
+        coords[offsets[i]:offsets[i+1]]. Rings closed by a ClosePath
+        command repeat their first vertex, as in GeoJSON.
+        """
+        coords, offsets, closed = geometry.decode_geometry(feature.geometry)
+        coords, offsets = geometry.close_rings(coords, offsets, closed)
+        x = self.extent.minx + (coords[:,0] / float(self.path_multiplier)) / self.ctrans.sx
+        y = self.extent.maxy - (coords[:,1] / float(self.path_multiplier)) / self.ctrans.sy
+        if lonlat:
+            x,y = merc2lonlat_array(x,y)
+        return np.column_stack((x,y)), offsets
+
+    def _geometry_parts(self, feature, lonlat=False, areas=False):
+        """
+        geometry_arrays for short command streams, decoded one vertex at
+        a time. Returns the parts as lists of [x, y] pairs and, when
+        areas is set, the signed area of each in tile coordinates.
+        """
+        parts, _ = geometry.decode_parts(feature.geometry)
+        ring_areas = [geometry.part_area(part) for part in parts] if areas else None
+        minx = self.extent.minx
+        maxy = self.extent.maxy
+        sx = self.ctrans.sx
+        sy = self.ctrans.sy
+        pm = float(self.path_multiplier)
+        for part in parts:
+            for vertex in part:
+                x = minx + (vertex[0] / pm) / sx
+                y = maxy - (vertex[1] / pm) / sy
+                if lonlat:
+                    x,y = merc2lonlat(x,y)
+                vertex[0] = x
+                vertex[1] = y
+        return parts, ring_areas
+
+    def layer(self, name):
+        "Return the layer called name, or None"
+        for layer in self.tile.layers:
+            if layer.name == name:
+                return layer
+        return None
+
+    def _select_layers(self, layer=None):
+        "The layers to read given a layer, a layer name or None for all"
+        if isinstance(layer, (str, unicode)):
+            layer = self.layer(layer)
+            return (layer,) if layer is not None else ()
+        elif layer is not None:
+            return (layer,)
+        return self.tile.layers
+
+    def _tag_lookup(self, layer):
+        "Return functions mapping a layer's key and value indices to Python values"
+        if isinstance(layer, LayerReader):
+            return layer.key, layer.value
+        keys = layer.keys
+        values = layer.values
+        return keys.__getitem__, lambda i: decode_value(values[i])
+
+    def geojson_feature(self, layer, feat, lonlat=False, layer_names=False, lookup=None,
+                        keep=None):
+        """
+        Decode feat of layer to a GeoJSON feature mapping. lookup is the
+        layer's _tag_lookup(), for callers decoding many features, and
+        keep an optional set of the key indices to decode.
+        """
+        fobj = {}
+        fobj['type'] = "Feature"
+        if lookup is None:
+            lookup = self._tag_lookup(layer)
+        key_of, value_of = lookup
+        properties = {}
+        tags = feat.tags
+        for i in range(0,len(tags),2):
+            if keep is not None and tags[i] not in keep:
+                continue
+            properties[str(key_of(tags[i]))] = value_of(tags[i+1])
+
+        if layer_names:
+            properties['layer'] = layer.name
+        fobj['properties'] = properties
+
+        if feat.type in (1,2,3):
+            if len(feat.geometry) <= SCALAR_GEOMETRY:
+                parts, areas = self._geometry_parts(feat, lonlat, feat.type == 3)
+            else:
+                coords, offsets = self.geometry_arrays(feat, lonlat=lonlat)
+                if feat.type == 3:
+                    areas = geometry.ring_areas(coords, offsets).tolist()
+                coords = coords.tolist()
+                offsets = offsets.tolist()
+                parts = [coords[offsets[i]:offsets[i+1]]
+                         for i in range(len(offsets)-1)]
+            if feat.type == 1:#point
+                if len(parts) == 1:
+                    fobj['geometry'] = {
+                        "type":"Point",
+                        "coordinates": parts[0][0]
+                    }
+                else:
+                    fobj['geometry'] = {
+                        "type":"MultiPoint",
+                        "coordinates": [p[0] for p in parts]
+                    }
+            elif feat.type == 2:#line
+                if len(parts) == 1:
+                    fobj['geometry'] = {
+                        "type":"LineString",
+                        "coordinates": parts[0]
+                    }
+                else:
+                    fobj['geometry'] = {
+                        "type":"MultiLineString",
+                        "coordinates": parts
+                    }
+            elif feat.type == 3:#polygon
+                # rings wound like the first one start a new polygon
+                polygons = []
+                for ring, area in zip(parts, areas):
+                    if not polygons or (area > 0) == (areas[0] > 0):
+                        polygons.append([ring])
+                    else:
+                        polygons[-1].append(ring)
+                if len(polygons) > 1:
+                    fobj['geometry'] = {
+                        "type":"MultiPolygon",
+                        "coordinates": polygons
+                    }
+                else:
+                    fobj['geometry'] = {
+                        "type":"Polygon",
+                        "coordinates": parts
+                    }
+
+        return fobj
+
+    def iter_geojson_features(self, layer=None, lonlat=False, layer_names=False):
+        """
+        Generate GeoJSON feature mappings one at a time.
+
+        Takes the same options as to_geojson but never holds more than a
+        single decoded feature.
+        """
+        for layer in self._select_layers(layer):
+            lookup = self._tag_lookup(layer)
+            for feat in layer.features:
+                yield self.geojson_feature(layer, feat, lonlat, layer_names, lookup)
+
+    def query(self, where=None, properties=None, layer=None, lonlat=False,
+              layer_names=False):
+        """
+        Generate the GeoJSON features matching where, with only the
+        properties listed in properties decoded.
+
+        where maps keys to a value, a collection of values or a callable,
+        see query.Query. Conditions are resolved against each layer's key
+        and value tables once, and features that fail them are skipped
+        by comparing tag indices, without decoding their properties or
+        geometry. layer restricts the search to one layer or layer name.
+        """
+        q = Query(where, properties)
+        for layer in self._select_layers(layer):
+            if isinstance(layer, LayerReader):
+                values = layer.values
+            else:
+                # a Value with no field set never matches, as for readers
+                values = [decode_value(v) if v.ListFields() else None
+                          for v in layer.values]
+            bound = q.resolve(layer.keys, values)
+            if bound is None:
+                continue
+            lookup = self._tag_lookup(layer)
+            for feat in layer.features:
+                if bound.matches(feat.tags):
+                    yield self.geojson_feature(layer, feat, lonlat, layer_names,
+                                               lookup, bound.keep)
+
+    def features(self, layer, lonlat=False, layer_names=False):
+        """
+        Lazy sequence of the GeoJSON features of layer, a layer or its
+        name. Each feature is decoded when it is accessed.
+        """
+        if isinstance(layer, (str, unicode)):
+            name = layer
+            layer = self.layer(name)
+            if layer is None:
+                raise KeyError(name)
+        return GeoJSONFeatures(self, layer, lonlat, layer_names)
+
     def to_geojson(self, layer=None,lonlat=False, layer_names=False):
         jobj = {}
         jobj['type'] = "FeatureCollection"
-        features = []
-        cmd_bits = 3
-        SEG_END    = 0
-        SEG_MOVETO = 1
-        SEG_LINETO = 2
-        SEG_CLOSE = (0x40 | 0x0f)
-
-        if layer:
-            layers = (layer,)
+        jobj['features'] = list(self.iter_geojson_features(
+            layer=layer, lonlat=lonlat, layer_names=layer_names))
+        return jobj
+
+    def write_geojson(self, fp, layer=None, lonlat=False, layer_names=False,
+                      newline_delimited=False):
+        """Stream this tile's features to fp, see write_geojson()"""
+        return write_geojson(fp, self.iter_geojson_features(
+            layer=layer, lonlat=lonlat, layer_names=layer_names),
+            newline_delimited=newline_delimited)
+
+    def _intern_tables(self, layer):
+        "Build the interning tables of a layer of a loaded tile"
+        keys = {}
+        for i,k in enumerate(layer.keys):
+            keys.setdefault(k,i)
+        values = {}
+        for i,val in enumerate(layer.values):
+            # a Value with no field set holds nothing to intern against
+            if val.ListFields():
+                values.setdefault(value_key(decode_value(val)),i)
+        self.keys[layer.name] = keys
+        self.values[layer.name] = values
+        return keys, values
+
+    def _tags(self, layer, props):
+        """Intern props into layer and return the feature's tag indices"""
+        stats = self.stats
+        if stats is not None:
+            t = clock()
+        keys = self.keys.get(layer.name)
+        if keys is None:
+            keys, values = self._intern_tables(layer)
         else:
-            layers = self.tile.layers
+            values = self.values[layer.name]
+        key_base = len(layer.keys)
+        value_base = len(layer.values)
+        new_keys = []
+        new_values = []
+        tags = []
+        try:
+            for k,v in props.items():
+                key_id = keys.get(k)
+                if key_id is None:
+                    layer.keys.append(k)
+                    key_id = keys[k] = key_base + len(new_keys)
+                    new_keys.append(k)
+                vkey = value_key(v)
+                value_id = values.get(vkey)
+                if value_id is None:
+                    setattr(layer.values.add(), value_fields[vkey[0]], v)
+                    value_id = values[vkey] = value_base + len(new_values)
+                    new_values.append(vkey)
+                tags.append(key_id)
+                tags.append(value_id)
+        except Exception:
+            # forget what was interned, as _intern_block does
+            del layer.keys[key_base:]
+            del layer.values[value_base:]
+            for k in new_keys:
+                del keys[k]
+            for vkey in new_values:
+                del values[vkey]
+            raise
+        if stats is not None:
+            stats.add('keys', len(new_keys))
+            stats.add('values', len(new_values))
+            stats.lap('attributes', t)
+        return tags
 
-        for layer in layers:
-            for feat in layer.features:
-                fobj = {}
-                fobj['type'] = "Feature"
-                properties = {}
-                for i in range(0,len(feat.tags),2):
-                    key_id = feat.tags[i]
-                    value_id = feat.tags[i+1]
-                    name = str(layer.keys[key_id])
-                    val = layer.values[value_id]
-                    if val.HasField('bool_value'):
-                        properties[name] = val.bool_value
-                    elif val.HasField('string_value'):
-                        properties[name] = val.string_value
-                    elif val.HasField('int_value'):
-                        properties[name] = val.int_value
-                    elif val.HasField('sint_value'):
-                        properties[name] = val.sint_value
-                    elif val.HasField('float_value'):
-                        properties[name] = val.float_value
-                    elif val.HasField('double_value'):
-                        properties[name] = val.double_value
-                    else:
-                        raise Exception("Unknown value type: '%s'" % val)
-
-                if layer_names:
-                    properties['layer'] = layer.name
-                fobj['properties'] = properties
-
-                geometry_count = len(feat.geometry)
-                if feat.type == 0:
-                    pass
-                elif feat.type == 1:#point
-                    x,y = self._decode_coords(feat.geometry[1],feat.geometry[2])
-                    if lonlat:
-                        x,y = merc2lonlat(x,y)
-                    fobj['geometry'] = {
-                        "type":"Point",
-                        "coordinates": [x,y]
-                    }
-                elif feat.type == 2 or feat.type == 3:#line polygon
-                    length = -1
-                    rings = []
-                    i = 0
-                    x = 0
-                    y = 0
-
-                    coordinates = []
-                    while (i < geometry_count):
-                        if length <= 0:
-                            cmd_length = feat.geometry[i]
-                            cmd = cmd_length & ((1 << cmd_bits) - 1)
-                            length = cmd_length >> cmd_bits
-                            i += 1
-
-                        if length > 0:
-                            length -= 1
-                            if cmd == SEG_MOVETO or cmd == SEG_LINETO:
-                                dx,dy = feat.geometry[i],feat.geometry[i+1]
-                                i += 2
-                                #zig zag decoding
-                                dx = ((dx >> 1) ^ (-(dx & 1)))
-                                dy = ((dy >> 1) ^ (-(dy & 1)))
-                                #delta decoding
-                                x += float(dx)/self.path_multiplier
-                                y += float(dy)/self.path_multiplier
-                                #At this point x/y is a coord encoded in tile coord space, from 0 to TILE_SIZE
-                                x_geo,y_geo = self.ctrans.backward(x,y)
-
-                                if lonlat:
-                                    x_geo,y_geo = merc2lonlat(x_geo,y_geo)
-                                if cmd == SEG_MOVETO:
-                                    if len(coordinates) > 0:
-                                        rings.append(coordinates)
-                                        coordinates = []
-                                coordinates.append([x_geo,y_geo])
-                            elif cmd == (SEG_CLOSE & ((1 << cmd_bits) - 1)):
-                                if len(coordinates) > 0:
-                                    coordinates.append(coordinates[0])
-                                    rings.append(coordinates)
-                                    coordinates = []
-                    if feat.type == 2:
-                        if len(rings):
-                            fobj['geometry'] = {
-                                "type":"MultiLineString",
-                                "coordinates": rings
-                            }
+    def _intern_block(self, layer, props_seq):
+        """
+        Intern the properties of many features like _tags.
+
+        Returns the tag indices of all features back to back and the
+        number of properties of each feature.
+        """
+        stats = self.stats
+        keys = self.keys.get(layer.name)
+        if keys is None:
+            keys, values = self._intern_tables(layer)
+        else:
+            values = self.values[layer.name]
+        key_base = len(layer.keys)
+        value_base = len(layer.values)
+        new_keys = []
+        new_values = []
+        tags = []
+        counts = []
+        append = tags.append
+        try:
+            for props in props_seq:
+                for k,v in props.items():
+                    key_id = keys.get(k)
+                    if key_id is None:
+                        key_id = keys[k] = key_base + len(new_keys)
+                        new_keys.append(k)
+                    # for values of the types in value_fields, (type, value)
+                    # is already their value_key
+                    vtype = type(v)
+                    value_id = values.get((vtype,v))
+                    if value_id is None:
+                        if vtype in value_fields:
+                            vkey = (vtype,v)
                         else:
-                            fobj['geometry'] = {
-                                "type":"LineString",
-                                "coordinates": coordinates
-                            }
-                    elif feat.type == 3:
-                        fobj['geometry'] = {
-                            "type":"Polygon",
-                            "coordinates": rings
-                        }
-
-                features.append(fobj)
-
-        jobj['features'] = features
-        return jobj
+                            vkey = value_key(v)
+                            value_id = values.get(vkey)
+                        if value_id is None:
+                            value_id = values[vkey] = value_base + len(new_values)
+                            new_values.append(vkey)
+                    append(key_id)
+                    append(value_id)
+                counts.append(len(props))
+            layer.keys.extend(new_keys)
+            for vtype,v in new_values:
+                setattr(layer.values.add(), value_fields[vtype], v)
+        except Exception:
+            # forget what was interned
+            del layer.keys[key_base:]
+            del layer.values[value_base:]
+            for k in new_keys:
+                del keys[k]
+            for vkey in new_values:
+                del values[vkey]
+            raise
+        if stats is not None:
+            stats.add('keys', len(new_keys))
+            stats.add('values', len(new_values))
+        return tags, counts
 
     def _handle_attr(self, layer, feature, props):
-        for k,v in props.items():
-            if k not in self.keys[layer.name]:
-                layer.keys.append(k)
-                self.keys[layer.name].append(k)
-            feature.tags.append(self.keys[layer.name].index(k))
-            if v not in self.values[layer.name]:
-                if (isinstance(v,bool)):
-                    val = layer.values.add()
-                    val.bool_value = v
-                elif (isinstance(v,str)) or (isinstance(v,unicode)):
-                    val = layer.values.add()
-                    val.string_value = v
-                elif (isinstance(v,int)):
-                    val = layer.values.add()
-                    val.int_value = v
-                elif (isinstance(v,float)):
-                    val = layer.values.add()
-                    val.double_value = v
-                else:
-                    raise Exception("Unknown value type: '%s'" % type(v))
-                self.values[layer.name].append(v)
-            feature.tags.append(self.values[layer.name].index(v))
+        tags = self._tags(layer, props)
+        del feature.tags[:]
+        feature.tags.extend(tags)
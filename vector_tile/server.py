@@ -0,0 +1,224 @@
+"""
+asyncio helpers for serving tiles.
+
+TileService answers z/x/y requests from a pluggable store without
+blocking the event loop: store reads and CPU-bound decoding run in
+executors, a bounded number of jobs run at once and callers beyond the
+queue limit are turned away, and concurrent requests for the same tile
+share one job.
+
+A store is any object with a get_tile(z, x, y) method returning bytes or
+None, such as mbtiles.MBTiles, archive.Archive, DirectoryStore or
+DictStore.
+
+This module needs Python 3.5 or later.
+"""
+
+import asyncio
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import content_hash
+from .compression import detect
+from .renderer import Request, VectorTile
+
+PATH_RE = re.compile(r'^/?(\d+)/(\d+)/(\d+)\.(\w+)$')
+
+CONTENT_TYPES = {
+    'mvt': 'application/vnd.mapbox-vector-tile',
+    'pbf': 'application/vnd.mapbox-vector-tile',
+    'geojson': 'application/geo+json',
+    'json': 'application/geo+json',
+}
+
+
+class ServiceBusy(Exception):
+    """Raised when too many requests are already waiting"""
+
+
+def parse_path(path):
+    """
+    Parse a '/z/x/y.ext' URL path into (Request, ext), ext being one of
+    CONTENT_TYPES. Raises ValueError for anything else.
+    """
+    m = PATH_RE.match(path.split('?', 1)[0])
+    if not m:
+        raise ValueError("not a tile path: '%s'" % path)
+    z, x, y = (int(n) for n in m.group(1, 2, 3))
+    ext = m.group(4)
+    if ext not in CONTENT_TYPES:
+        raise ValueError("unknown tile format: '%s'" % ext)
+    if z > 22 or x >= (1 << z) or y >= (1 << z):
+        raise ValueError("tile out of range: '%s'" % path)
+    return Request(x, y, z), ext
+
+
+def render_geojson(z, x, y, data):
+    """
+    Decode a (possibly compressed) tile to GeoJSON bytes. Module level
+    so a ProcessPoolExecutor can run it.
+    """
+    req = Request(x, y, z)
+    jobj = VectorTile.from_message(req, data).to_geojson(lonlat=True, layer_names=True)
+    return json.dumps(jobj).encode('utf-8')
+
+
+class DictStore(object):
+    """In-memory store mapping (z, x, y) to tile bytes"""
+    def __init__(self, tiles=None):
+        self.tiles = dict(tiles or {})
+
+    def get_tile(self, z, x, y):
+        return self.tiles.get((z, x, y))
+
+
+class DirectoryStore(object):
+    """Store reading root/z/x/y.ext files"""
+    def __init__(self, root, ext='mvt'):
+        self.root = root
+        self.ext = ext
+
+    def get_tile(self, z, x, y):
+        path = os.path.join(self.root, str(z), str(x), '%d.%s' % (y, self.ext))
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+
+class TileService(object):
+    """
+    Serve tiles from store.
+
+    executor runs the CPU-bound work and defaults to a thread pool of
+    max_workers; pass a ProcessPoolExecutor to use several cores. At
+    most max_workers jobs run at once and at most max_waiting more may
+    queue for a slot before ServiceBusy is raised.
+
+    cache, a cache.TileCache, keeps the GeoJSON responses of hot tiles.
+    It is consulted and filled on the event loop, so only tile bytes
+    reach the executor and it works with either kind of pool.
+    """
+    def __init__(self, store, executor=None, max_workers=4, max_waiting=64,
+                 cache=None):
+        self.store = store
+        self.cache = cache
+        self.executor = executor or ThreadPoolExecutor(max_workers)
+        self.max_waiting = max_waiting
+        self._slots = asyncio.Semaphore(max_workers)
+        self.max_workers = max_workers
+        self._pending = 0
+        self._inflight = {}
+
+    async def get(self, req, ext='mvt'):
+        """
+        Return (content type, headers, body) for req in format ext, or
+        None if the store has no such tile
+        """
+        key = (req.zoom, req.x, req.y, ext)
+        task = self._inflight.get(key)
+        if task is None:
+            if self._pending >= self.max_workers + self.max_waiting:
+                raise ServiceBusy()
+            task = asyncio.ensure_future(self._run(req, ext))
+            self._inflight[key] = task
+            self._pending += 1
+            task.add_done_callback(lambda t: self._done(key))
+        return await asyncio.shield(task)
+
+    def _done(self, key):
+        self._pending -= 1
+        del self._inflight[key]
+
+    async def _run(self, req, ext):
+        loop = asyncio.get_event_loop()
+        await self._slots.acquire()
+        try:
+            data = await loop.run_in_executor(
+                None, self.store.get_tile, req.zoom, req.x, req.y)
+            if data is None:
+                return None
+            headers = {}
+            if ext in ('geojson', 'json'):
+                body = await self._geojson(loop, req, bytes(data))
+            else:
+                body = bytes(data)
+                if detect(body) == 'gzip':
+                    headers['Content-Encoding'] = 'gzip'
+            return CONTENT_TYPES[ext], headers, body
+        finally:
+            self._slots.release()
+
+    async def _geojson(self, loop, req, data):
+        cache = self.cache
+        if cache is not None:
+            key = ('geojson', content_hash(data), req.zoom, req.x, req.y)
+            body = cache.get(key)
+            if body is not None:
+                return body
+        body = await loop.run_in_executor(
+            self.executor, render_geojson, req.zoom, req.x, req.y, data)
+        if cache is not None:
+            cache.put(key, body, len(body))
+        return body
+
+    async def handle(self, reader, writer):
+        """asyncio.start_server callback answering one HTTP/1.x request"""
+        try:
+            line = await reader.readline()
+            while True:
+                header = await reader.readline()
+                if header in (b'\r\n', b'\n', b''):
+                    break
+            try:
+                method, path, _ = line.decode('latin-1').split(' ', 2)
+            except ValueError:
+                await self._respond(writer, 400, b'bad request')
+                return
+            if method not in ('GET', 'HEAD'):
+                await self._respond(writer, 405, b'method not allowed')
+                return
+            try:
+                req, ext = parse_path(path)
+            except ValueError as e:
+                await self._respond(writer, 404, str(e).encode('utf-8'))
+                return
+            try:
+                result = await self.get(req, ext)
+            except ServiceBusy:
+                await self._respond(writer, 503, b'busy')
+                return
+            except Exception:
+                # a corrupt tile or a failing store
+                await self._respond(writer, 500, b'internal server error')
+                return
+            if result is None:
+                await self._respond(writer, 404, b'no such tile')
+                return
+            content_type, headers, body = result
+            await self._respond(writer, 200, body if method == 'GET' else b'',
+                                content_type, headers, len(body))
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, body, content_type='text/plain',
+                       headers=None, length=None):
+        reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+                   405: 'Method Not Allowed', 500: 'Internal Server Error',
+                   503: 'Service Unavailable'}
+        lines = ['HTTP/1.1 %d %s' % (status, reasons[status]),
+                 'Content-Type: %s' % content_type,
+                 'Content-Length: %d' % (len(body) if length is None else length),
+                 'Connection: close']
+        for name, value in (headers or {}).items():
+            lines.append('%s: %s' % (name, value))
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        writer.write(body)
+        await writer.drain()
+
+    def serve(self, host='127.0.0.1', port=8080):
+        "Return a coroutine starting an HTTP server, see asyncio.start_server"
+        return asyncio.start_server(self.handle, host, port)
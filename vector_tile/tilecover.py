@@ -0,0 +1,228 @@
+"""
+Tile cover: find the XYZ tiles a geometry touches at a given zoom.
+
+Coordinates are spherical mercator (epsg:3857), as everywhere else in
+renderer. Lines are walked through the tile grid segment by segment and
+polygons are filled row by row between their ring crossings, following
+the approach of mapbox/tile-cover.
+"""
+
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from .renderer import MAX_EXTENT
+
+
+def tile_coords(xs, ys, zoom):
+    """
+    Convert arrays of mercator coordinates to fractional tile coordinates
+    at zoom, where tile (x, y) spans [x, x+1) by [y, y+1).
+    """
+    scale = (1 << zoom) / (2 * MAX_EXTENT)
+    tx = (np.asarray(xs, dtype=np.float64) + MAX_EXTENT) * scale
+    ty = (MAX_EXTENT - np.asarray(ys, dtype=np.float64)) * scale
+    return tx, ty
+
+
+def _valid(tiles, zoom):
+    n = 1 << zoom
+    return set((zoom, x, y) for x, y in tiles if 0 <= x < n and 0 <= y < n)
+
+
+def point_cover(xs, ys, zoom):
+    "Return the set of (z, x, y) tiles containing the given points"
+    tx, ty = tile_coords(xs, ys, zoom)
+    n = (1 << zoom) - 1
+    tx = np.clip(np.floor(tx), 0, n).astype(np.int64)
+    ty = np.clip(np.floor(ty), 0, n).astype(np.int64)
+    pairs = np.unique(np.column_stack((tx, ty)), axis=0)
+    return set((zoom, x, y) for x, y in pairs.tolist())
+
+
+def _line_tiles(coords, zoom, tiles, ring=None):
+    """
+    Add the (x, y) tiles crossed by a line to the set tiles.
+
+    When ring is a list, the tiles where the walk changes row are
+    appended to it, for polygon filling.
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    tx, ty = tile_coords(coords[:,0], coords[:,1], zoom)
+    tx = tx.tolist()
+    ty = ty.tolist()
+    prev_x = prev_y = None
+    x = y = None
+    for i in range(len(tx) - 1):
+        x0, y0, x1, y1 = tx[i], ty[i], tx[i+1], ty[i+1]
+        dx = x1 - x0
+        dy = y1 - y0
+        if dx == 0 and dy == 0:
+            continue
+        sx = 1 if dx > 0 else -1
+        sy = 1 if dy > 0 else -1
+        x = int(math.floor(x0))
+        y = int(math.floor(y0))
+        t_max_x = float('inf') if dx == 0 else abs(((1 if dx > 0 else 0) + x - x0) / dx)
+        t_max_y = float('inf') if dy == 0 else abs(((1 if dy > 0 else 0) + y - y0) / dy)
+        t_dx = float('inf') if dx == 0 else abs(sx / dx)
+        t_dy = float('inf') if dy == 0 else abs(sy / dy)
+        if x != prev_x or y != prev_y:
+            tiles.add((x, y))
+            if ring is not None and y != prev_y:
+                ring.append((x, y))
+            prev_x, prev_y = x, y
+        while t_max_x < 1 or t_max_y < 1:
+            if t_max_x < t_max_y:
+                t_max_x += t_dx
+                x += sx
+            else:
+                t_max_y += t_dy
+                y += sy
+            tiles.add((x, y))
+            if ring is not None and y != prev_y:
+                ring.append((x, y))
+            prev_x, prev_y = x, y
+    if ring and y == ring[0][1]:
+        ring.pop()
+    if x is None and len(tx):
+        # degenerate line, all vertices coincide
+        tiles.add((int(math.floor(tx[0])), int(math.floor(ty[0]))))
+
+
+def line_cover(coords, zoom):
+    "Return the set of (z, x, y) tiles a line string intersects"
+    tiles = set()
+    _line_tiles(coords, zoom, tiles)
+    return _valid(tiles, zoom)
+
+
+def polygon_cover(rings, zoom):
+    """
+    Return the set of (z, x, y) tiles a polygon, given as a sequence of
+    rings, intersects
+    """
+    tiles = set()
+    crossings = []
+    for coords in rings:
+        ring = []
+        _line_tiles(coords, zoom, tiles, ring)
+        n = len(ring)
+        for j in range(n):
+            k = j - 1
+            m = (j + 1) % n
+            y = ring[j][1]
+            # a crossing unless it is a local extremum or a duplicate
+            if ((y > ring[k][1] or y > ring[m][1]) and
+                    (y < ring[k][1] or y < ring[m][1]) and
+                    y != ring[m][1]):
+                crossings.append(ring[j])
+    crossings.sort(key=lambda t: (t[1], t[0]))
+    for i in range(0, len(crossings) - 1, 2):
+        y = crossings[i][1]
+        for x in range(crossings[i][0] + 1, crossings[i+1][0]):
+            tiles.add((x, y))
+    return _valid(tiles, zoom)
+
+
+def geometry_cover(geometry, zoom):
+    """
+    Return the set of (z, x, y) tiles a GeoJSON-like geometry mapping in
+    mercator coordinates intersects
+    """
+    gtype = geometry['type']
+    coords = geometry['coordinates']
+    if gtype == 'Point':
+        return point_cover([coords[0]], [coords[1]], zoom)
+    elif gtype == 'MultiPoint':
+        if not coords:
+            return set()
+        coords = np.asarray(coords, dtype=np.float64)
+        return point_cover(coords[:,0], coords[:,1], zoom)
+    elif gtype == 'LineString':
+        return line_cover(coords, zoom)
+    elif gtype == 'MultiLineString':
+        return set().union(*[line_cover(part, zoom) for part in coords])
+    elif gtype == 'Polygon':
+        return polygon_cover(coords, zoom)
+    elif gtype == 'MultiPolygon':
+        return set().union(*[polygon_cover(part, zoom) for part in coords])
+    raise ValueError("Unknown geometry type: '%s'" % gtype)
+
+
+def _bounds(coords):
+    "Min and max of the coordinate pairs nested anywhere in coords"
+    if not len(coords):
+        return None
+    if not isinstance(coords[0], (list, tuple, np.ndarray)):
+        return coords[0], coords[1], coords[0], coords[1]
+    found = [b for b in (_bounds(c) for c in coords) if b is not None]
+    if not found:
+        return None
+    return (min(b[0] for b in found), min(b[1] for b in found),
+            max(b[2] for b in found), max(b[3] for b in found))
+
+
+def _grow(tiles, geometry, zoom, buffer):
+    """
+    Add to tiles the neighbours whose extent grown by buffer, in tile
+    units, the bounding box of geometry reaches into
+    """
+    bounds = _bounds(geometry['coordinates'])
+    if bounds is None:
+        return tiles
+    tx, ty = tile_coords([bounds[0], bounds[2]], [bounds[3], bounds[1]], zoom)
+    minx, maxx = tx.tolist()
+    miny, maxy = ty.tolist()
+    grown = set()
+    for z, x, y in tiles:
+        for nx in (x - 1, x, x + 1):
+            if maxx < nx - buffer or minx > nx + 1 + buffer:
+                continue
+            for ny in (y - 1, y, y + 1):
+                if maxy < ny - buffer or miny > ny + 1 + buffer:
+                    continue
+                grown.add((nx, ny))
+    return tiles | _valid(grown, zoom)
+
+
+def bucket_features(features, zoom, buffer=0):
+    """
+    Group GeoJSON-like features by the tiles they intersect at zoom.
+
+    Returns a dict mapping (z, x, y) to the list of features touching
+    that tile. Point features are binned together in one array pass.
+
+    buffer, in tile units, also puts other features in the buckets of
+    the tiles they come within that distance of, judged by their
+    bounding box, so tiles rendered with a buffer see everything drawn
+    in it. Single points are binned by their tile alone, as renderers
+    skip points outside the tile.
+    """
+    buckets = defaultdict(list)
+    points = []
+    xs = []
+    ys = []
+    for f in features:
+        g = f.get('geometry')
+        if not g:
+            continue
+        if g['type'] == 'Point':
+            points.append(f)
+            xs.append(g['coordinates'][0])
+            ys.append(g['coordinates'][1])
+        else:
+            tiles = geometry_cover(g, zoom)
+            if buffer and tiles:
+                tiles = _grow(tiles, g, zoom, buffer)
+            for tile in tiles:
+                buckets[tile].append(f)
+    if points:
+        n = (1 << zoom) - 1
+        tx, ty = tile_coords(xs, ys, zoom)
+        tx = np.clip(np.floor(tx), 0, n).astype(np.int64).tolist()
+        ty = np.clip(np.floor(ty), 0, n).astype(np.int64).tolist()
+        for f, x, y in zip(points, tx, ty):
+            buckets[(zoom, x, y)].append(f)
+    return dict(buckets)